@@ -23,6 +23,7 @@ from pathlib import Path
 
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_huggingface import HuggingFaceEmbeddings
 from pydantic import BaseModel, Field
 
@@ -72,6 +73,15 @@ class ComplianceResult(BaseModel):
 # RAG Configuration
 # ============================================================================
 
+def _distance_strategy(index) -> DistanceStrategy:
+    """save_local does not persist the distance strategy; read it back from the index metric"""
+    import faiss
+
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return DistanceStrategy.MAX_INNER_PRODUCT
+    return DistanceStrategy.EUCLIDEAN_DISTANCE
+
+
 class RAGConfig:
     """RAG system configuration and initialization"""
 
@@ -129,6 +139,7 @@ class RAGConfig:
                     self.embeddings,
                     allow_dangerous_deserialization=True
                 )
+                self.vectorstore_acts.distance_strategy = _distance_strategy(self.vectorstore_acts.index)
                 print("✓ Loaded Acts vector store")
 
             if judgments_path.exists():
@@ -137,6 +148,7 @@ class RAGConfig:
                     self.embeddings,
                     allow_dangerous_deserialization=True
                 )
+                self.vectorstore_judgments.distance_strategy = _distance_strategy(self.vectorstore_judgments.index)
                 print("✓ Loaded Judgments vector store")
 
         except Exception as e:
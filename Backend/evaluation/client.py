@@ -1,16 +1,28 @@
 import requests
 import json
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    orjson = None  # type: ignore
 
 API_URL = "http://127.0.0.1:8000/api/v1/analyze"
 
+# Reuse one pooled connection across queries instead of reconnecting every time
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+_SESSION.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip"})
+
 def ask_question(query):
     """Sends a query to the running API server and prints the response."""
     try:
         payload = {"query": query}
-        response = requests.post(API_URL, json=payload, timeout=300) # 300-second timeout for long queries
+        response = _SESSION.post(API_URL, json=payload, timeout=300) # 300-second timeout for long queries
         response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
         
-        data = response.json()
+        data = orjson.loads(response.content) if orjson is not None else response.json()
         print("\n--- AI Analyst Response ---")
         print(data.get("analysis", "No analysis found in the response."))
         print("---------------------------\n")
@@ -1,3 +1,5 @@
+import asyncio
+import io
 import json
 import math
 import os
@@ -10,12 +12,19 @@ from rouge_score import rouge_scorer
 
 # Optional: pandas is used by the runner for saving tables
 
+# Optional: orjson speeds up large dataset/docstore/result files; stdlib json is the fallback
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    orjson = None  # type: ignore
+
 # --------------------
 # Text normalization + core QA metrics (SQuAD-style)
 # --------------------
 import re
 import string
 from collections import Counter
+from functools import lru_cache
 
 ARTICLES = {"a", "an", "the"}
 
@@ -32,13 +41,25 @@ def normalize_answer(s: str) -> str:
         return " ".join(text.split())
     return white_space_fix(remove_articles(remove_punc(lower(s))))
 
+@lru_cache(maxsize=200_000)
+def _tok_counter(s: str) -> Tuple[Tuple[str, ...], Counter]:
+    """Normalized tokens and their counts; cached since the same pred/gold strings
+    are scored repeatedly across retrievers and k values. Do not mutate the Counter."""
+    toks = tuple(normalize_answer(s).split())
+    return toks, Counter(toks)
+
 def em_score(pred: str, gold: str) -> float:
-    return 1.0 if normalize_answer(pred) == normalize_answer(gold) else 0.0
+    return 1.0 if _tok_counter(pred)[0] == _tok_counter(gold)[0] else 0.0
 
 def f1_score_squad(pred: str, gold: str) -> float:
-    pred_tokens = normalize_answer(pred).split()
-    gold_tokens = normalize_answer(gold).split()
-    common = Counter(pred_tokens) & Counter(gold_tokens)
+    pred_tokens, pred_counter = _tok_counter(pred)
+    gold_tokens, gold_counter = _tok_counter(gold)
+    return f1_from_prepared(pred_tokens, pred_counter, gold_tokens, gold_counter)
+
+def f1_from_prepared(pred_tokens: Tuple[str, ...], pred_counter: Counter,
+                     gold_tokens: Tuple[str, ...], gold_counter: Counter) -> float:
+    """SQuAD F1 from already-tokenized inputs (see _tok_counter)."""
+    common = pred_counter & gold_counter
     num_same = sum(common.values())
     if len(pred_tokens) == 0 or len(gold_tokens) == 0:
         return float(pred_tokens == gold_tokens)
@@ -63,7 +84,7 @@ def rouge_scores(pred: str, gold: str) -> Dict[str, float]:
 # --------------------
 
 def load_indiclegalqa(path: str) -> List[Dict[str, Any]]:
-    data = json.loads(Path(path).read_text(encoding='utf-8'))
+    data = json_loads(Path(path).read_bytes())
     samples = []
     for i, ex in enumerate(data):
         samples.append({
@@ -135,7 +156,7 @@ def build_source_catalog_from_faiss(faiss_dir: str) -> List[str]:
     docstore_json = dir_path / "docstore.json"
     if docstore_json.exists():
         try:
-            obj = json.loads(docstore_json.read_text(encoding='utf-8'))
+            obj = json_loads(docstore_json.read_bytes())
             store = obj.get("_dict", {}).get("store", {})
             for _, item in store.items():
                 md = item.get("metadata", {}) or {}
@@ -267,11 +288,38 @@ def ndcg_at_k(retrieved_items: List[Dict[str, Any]], relevant_sources: Set[str],
     return dcg / idcg if dcg > 0 else 0.0
 
 
+def relevance_matrix(retrieved_all: List[List[Dict[str, Any]]], relevant_all: List[Set[str]], k: int) -> np.ndarray:
+    """(N, k) boolean mask, True where the source retrieved at that rank is relevant to the sample.
+    Sources are mapped to int ids once so membership is tested with np.isin instead of per-item set lookups."""
+    src_to_id: Dict[str, int] = {}
+    ids = np.full((len(retrieved_all), k), -1, dtype=np.int32)
+    for i, items in enumerate(retrieved_all):
+        for j, it in enumerate(items[:k]):
+            ids[i, j] = src_to_id.setdefault(it.get("metadata", {}).get("source"), len(src_to_id))
+    mask = np.zeros(ids.shape, dtype=bool)
+    for i, relevant in enumerate(relevant_all):
+        rel_ids = [src_to_id[s] for s in relevant if s in src_to_id]
+        if rel_ids:
+            mask[i] = np.isin(ids[i], rel_ids)
+    return mask
+
+
+def ranking_metrics(rel_mask: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized is_hit / reciprocal first_relevant_rank / ndcg_at_k over the top-k columns of a relevance mask."""
+    m = rel_mask[:, :k]
+    found = m.any(axis=1)
+    hit = found.astype(np.float64)
+    mrr = np.where(found, 1.0 / (m.argmax(axis=1) + 1), 0.0)
+    ndcg = (m * (1.0 / np.log2(np.arange(2, m.shape[1] + 2)))).sum(axis=1)
+    return hit, mrr, ndcg
+
+
 def oracle_answerable(retrieved_items: List[Dict[str, Any]], gold_answer: str) -> float:
     ans_norm = normalize_answer(gold_answer)
+    if not ans_norm:
+        return 0.0
     for it in retrieved_items:
-        text = normalize_answer(it.get("text", ""))
-        if ans_norm and ans_norm in text:
+        if ans_norm in normalize_answer(it.get("text", "") or ""):
             return 1.0
     return 0.0
 
@@ -279,23 +327,152 @@ def oracle_answerable(retrieved_items: List[Dict[str, Any]], gold_answer: str) -
 # Simple retriever wrappers over LangChain FAISS
 # --------------------
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.embeddings import Embeddings
 import torch
 
+def _distance_strategy(index) -> DistanceStrategy:
+    """save_local does not persist the store's distance strategy, so recover it from the index metric:
+    the inner-product IVF/OPQ stores would otherwise load as EUCLIDEAN_DISTANCE."""
+    import faiss
+
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return DistanceStrategy.MAX_INNER_PRODUCT
+    return DistanceStrategy.EUCLIDEAN_DISTANCE
+
+
+def _load_faiss_mmap(faiss_dir: str, embeddings) -> FAISS | None:
+    """Load a LangChain FAISS store with the vector index memory-mapped read-only.
+
+    Only the small docstore pickle is deserialized; vectors stay in the OS page cache.
+    Returns None if the index type/faiss build does not support mmap so the caller
+    can fall back to FAISS.load_local.
+    """
+    import pickle
+    import faiss
+
+    dir_path = Path(faiss_dir)
+    try:
+        index = faiss.read_index(str(dir_path / "index.faiss"), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except Exception:
+        return None
+    with open(dir_path / "index.pkl", "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id, distance_strategy=_distance_strategy(index))
+
+
+_TORCH_THREADS_CONFIGURED = False
+
+def _configure_torch_threads():
+    """Use all cores for CPU query encoding (PyTorch may default to 1 thread in subprocesses).
+    Interop threads can only be set once per process, so this runs at most once."""
+    global _TORCH_THREADS_CONFIGURED
+    if _TORCH_THREADS_CONFIGURED:
+        return
+    _TORCH_THREADS_CONFIGURED = True
+    torch.set_num_threads(os.cpu_count() or 1)
+    try:
+        torch.set_num_interop_threads(2)
+    except RuntimeError:
+        pass  # parallel work already started in this process
+    try:
+        torch.set_float32_matmul_precision("high")
+    except Exception:
+        pass
+
+
+def load_embedder(embed_model: str, fp16: bool = False, int8: bool = False):
+    """Load the query SentenceTransformer once (GPU if available) in inference mode.
+    Share the result between FaissRetrievers and embed_queries instead of reloading it.
+
+    fp16 runs the model in half precision on GPU; int8 applies dynamic INT8 quantization
+    to its Linear layers on CPU. Each is ignored (with a warning) on the other device.
+    Vectors handed to FAISS are always float32.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    _configure_torch_threads()
+    use_cuda = torch.cuda.is_available()
+    embedder = SentenceTransformer(embed_model, device="cuda" if use_cuda else "cpu")
+    embedder.eval()
+    if fp16:
+        if use_cuda:
+            embedder.half()
+        else:
+            print("Warning: --fp16 needs CUDA; encoding queries in float32.")
+    if int8:
+        if not use_cuda:
+            embedder = torch.quantization.quantize_dynamic(embedder, {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            print("Warning: --int8 dynamic quantization is CPU-only; ignoring on CUDA.")
+    return embedder
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """LangChain Embeddings over an already-loaded SentenceTransformer (normalized vectors)."""
+
+    def __init__(self, embedder, batch_size: int = 64):
+        self.embedder = embedder
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with torch.inference_mode():
+            vecs = self.embedder.encode(list(texts), batch_size=self.batch_size,
+                                        convert_to_numpy=True, normalize_embeddings=True)
+        return vecs.astype(np.float32).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
 class FaissRetriever:
-    def __init__(self, faiss_dir: str, embed_model: str = "sentence-transformers/all-MiniLM-L6-v2"):
+    def __init__(self, faiss_dir: str, embed_model: str = "sentence-transformers/all-MiniLM-L6-v2", mmap: bool = True,
+                 use_gpu: bool = False, gpu_fp16: bool = False, parallel_mode: int | None = None,
+                 embedder=None):
         self.faiss_dir = os.path.abspath(faiss_dir)
         self.embed_model = embed_model
-        use_cuda = torch.cuda.is_available()
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=embed_model,
-            model_kwargs={"device": "cuda" if use_cuda else "cpu"},
-            encode_kwargs={"normalize_embeddings": True},
-        )
-        # allow_dangerous_deserialization required for older index formats
-        self.db = FAISS.load_local(self.faiss_dir, self.embeddings, allow_dangerous_deserialization=True)
+        # Pass a shared embedder (see load_embedder) to avoid loading one model copy per store
+        self.embedder = embedder if embedder is not None else load_embedder(embed_model)
+        self.embeddings = SentenceTransformerEmbeddings(self.embedder)
+        self.db = _load_faiss_mmap(self.faiss_dir, self.embeddings) if mmap else None
+        if self.db is None:
+            # allow_dangerous_deserialization required for older index formats
+            self.db = FAISS.load_local(self.faiss_dir, self.embeddings, allow_dangerous_deserialization=True)
+            self.db.distance_strategy = _distance_strategy(self.db.index)
+        if parallel_mode is not None:
+            self._set_parallel_mode(parallel_mode)
+        self._gpu_res = None
+        if use_gpu:
+            self._move_index_to_gpu(fp16=gpu_fp16)
         self.name = Path(self.faiss_dir).name
 
+    def _set_parallel_mode(self, mode: int):
+        """Choose how FAISS threads a search on IVF indexes: 0 (default) splits the query batch
+        across threads, which suits batched search; 2 splits the inverted lists of each query,
+        which speeds up one-at-a-time queries such as retrieve(). Flat indexes ignore this."""
+        import faiss
+
+        faiss.omp_set_num_threads(os.cpu_count() or 1)
+        # The IVF layer may sit under a pre-transform (OPQ) wrapper, which has no parallel_mode of its own
+        try:
+            ivf = faiss.extract_index_ivf(self.db.index)
+        except RuntimeError:
+            return  # not an IVF index
+        ivf.parallel_mode = mode
+
+    def _move_index_to_gpu(self, fp16: bool = False):
+        """Clone the FAISS index onto GPU 0 (requires faiss-gpu); stays on CPU otherwise.
+        fp16 stores vectors in half precision to halve GPU memory."""
+        import faiss
+
+        if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+            print(f"Warning: no FAISS GPU support available; keeping {self.faiss_dir} on CPU.")
+            return
+        self._gpu_res = faiss.StandardGpuResources()  # must outlive the GPU index
+        co = faiss.GpuClonerOptions()
+        co.useFloat16 = fp16
+        self.db.index = faiss.index_cpu_to_gpu(self._gpu_res, 0, self.db.index, co)
+
     def retrieve(self, query: str, k: int) -> List[Dict[str, Any]]:
         docs = self.db.similarity_search_with_score(query, k=k)
         items = []
@@ -307,6 +484,50 @@ class FaissRetriever:
             })
         return items
 
+    def search_vectors(self, xq: np.ndarray, k: int) -> List[List[Dict[str, Any]]]:
+        """Search pre-computed query embeddings (N, d) without re-encoding; see embed_queries."""
+        if len(xq) == 0:
+            return []
+        xq = np.ascontiguousarray(xq, dtype=np.float32)
+        D, I = self.db.index.search(xq, k)
+        id_map = self.db.index_to_docstore_id
+        results: List[List[Dict[str, Any]]] = []
+        for row_d, row_i in zip(D, I):
+            items = []
+            for score, idx in zip(row_d, row_i):
+                if idx == -1:
+                    continue  # fewer than k vectors in the index
+                d = self.db.docstore.search(id_map[int(idx)])
+                items.append({
+                    "text": d.page_content,
+                    "score": float(score),
+                    "metadata": dict(d.metadata or {}),
+                })
+            results.append(items)
+        return results
+
+def embed_queries(texts: List[str], embedder, e5: bool = False, batch_size: int = 128) -> np.ndarray:
+    """Encode all query texts in one batched SentenceTransformer pass.
+
+    `embedder` is a loaded SentenceTransformer (see load_embedder) or a model name.
+    Returns a float32 (N, d) array of unit-normalized embeddings in input order, ready for
+    FaissRetriever.search_vectors. With e5=True queries get the E5 'query: ' prefix.
+    SentenceTransformer.encode already length-sorts internally to minimise padding.
+    """
+    if isinstance(embedder, str):
+        embedder = load_embedder(embedder)
+    if e5:
+        texts = ["query: " + t for t in texts]
+    with torch.inference_mode():
+        vecs = embedder.encode(
+            list(texts),
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=True,
+        )
+    return np.asarray(vecs, dtype=np.float32)
+
 # --------------------
 # LLM integration (Gemini) and prompt helpers (optional)
 # --------------------
@@ -322,19 +543,21 @@ def build_passage_block(items: List[Dict[str, Any]], per_snippet_chars: int = 80
     """Format retrieved items into a passages block with conservative truncation.
     Truncates each snippet and caps total characters to keep prompts within model context.
     """
-    lines = []
+    out = io.StringIO()
     used = 0
     for idx, it in enumerate(items, start=1):
-        src = (it.get("metadata", {}) or {}).get("source", "")
-        snippet = (it.get("text", "") or "").strip()
+        md = it.get("metadata") or {}
+        src = md.get("source", "")
+        snippet = (it.get("text") or "").strip()
         if per_snippet_chars > 0 and len(snippet) > per_snippet_chars:
             snippet = snippet[:per_snippet_chars] + "…"
         block = f"[{idx}] {snippet}\n(Source: {src})\n\n"
-        if total_chars > 0 and used + len(block) > total_chars:
+        n = len(block)
+        if total_chars > 0 and used + n > total_chars:
             break
-        lines.append(block)
-        used += len(block)
-    return "".join(lines).strip()
+        out.write(block)
+        used += n
+    return out.getvalue().strip()
 
 # Lazy import to avoid requiring google-generativeai unless used
 try:
@@ -374,6 +597,19 @@ def gemini_generate(prompt: str, api_key: str | None = None, model_name: str = "
     except Exception:
         return ""
 
+async def gemini_generate_many(prompts: List[str], api_key: str | None = None, model_name: str = "gemini-1.5-pro",
+                               max_output_tokens: int = 512, concurrency: int = 8) -> List[str]:
+    """Run gemini_generate over many prompts concurrently (at most `concurrency` in flight).
+    Results are returned in prompt order; failed calls yield empty strings as in gemini_generate.
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def _one(prompt: str) -> str:
+        async with sem:
+            return await asyncio.to_thread(gemini_generate, prompt, api_key, model_name, max_output_tokens)
+
+    return list(await asyncio.gather(*(_one(p) for p in prompts)))
+
 # --------------------
 # Utility
 # --------------------
@@ -382,6 +618,35 @@ def ensure_dir(p: str | Path):
     Path(p).mkdir(parents=True, exist_ok=True)
 
 
+def json_loads(data: str | bytes) -> Any:
+    """Parse JSON with orjson when available, else stdlib json."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj: Any, indent: bool = False) -> str:
+    """Serialize to a JSON string (UTF-8, non-ASCII kept) with orjson when available."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            return orjson.dumps(obj, option=option).decode("utf-8")
+        except TypeError:
+            pass  # e.g. unsupported types; stdlib json below raises a clearer error
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None)
+
+
+def json_line(obj: Any) -> bytes:
+    """Serialize one JSONL line (UTF-8 bytes incl. trailing newline) for files opened in binary mode.
+    orjson produces bytes directly, skipping a str encode round-trip."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            pass
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
 def save_json(path: str | Path, obj: Any):
     Path(path).parent.mkdir(parents=True, exist_ok=True)
-    Path(path).write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding='utf-8')
+    Path(path).write_text(json_dumps(obj, indent=True), encoding='utf-8')
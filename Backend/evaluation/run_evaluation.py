@@ -1,9 +1,17 @@
 import argparse
+import asyncio
+import csv
+import hashlib
 import json
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
 from pathlib import Path
-from statistics import mean
-from typing import Dict, Any, List, Set
+from typing import Dict, Any, List, Set, Tuple
+
+# Let OpenMP/MKL use every core; must be set before torch is imported (via eval_utils)
+os.environ.setdefault("OMP_NUM_THREADS", str(os.cpu_count() or 1))
 
 import pandas as pd
 import google.generativeai as genai
@@ -12,6 +20,8 @@ from tqdm import tqdm
 from eval_utils import (
     load_indiclegalqa,
     FaissRetriever,
+    load_embedder,
+    embed_queries,
     build_source_catalog_from_faiss,
     match_relevant_sources,
     em_score,
@@ -20,40 +30,54 @@ from eval_utils import (
     is_hit,
     first_relevant_rank,
     ndcg_at_k,
+    relevance_matrix,
+    ranking_metrics,
     oracle_answerable,
     ensure_dir,
     save_json,
+    json_loads,
+    json_line,
     normalize_answer,
     CITATION_PROMPT,
     build_passage_block,
-    gemini_generate,
+    gemini_generate_many,
 )
 
 # ----------------------------
 # Simple retrieval-only QA heuristic
 # ----------------------------
 
-def best_sentence_from_text(text: str, question: str) -> str:
-    """Pick the sentence with the highest token overlap with question.
+_SENTENCE_SPLIT_RE = re.compile(r"[.\n]")
+
+
+def question_tokens(question: str) -> frozenset[str]:
+    """Normalized question token set; computed once per sample and reused for every store and k."""
+    return frozenset(normalize_answer(question).split())
+
+
+def best_sentence_from_text(text: str, q_tokens: frozenset[str]) -> str:
+    """Pick the sentence with the highest token overlap with the question tokens.
     This is a simple, non-LLM baseline for capstone evaluation.
     """
     if not text:
         return ""
-    # Split on periods and newlines
-    sentences = []
-    for seg in text.split("\n"):
-        sentences.extend([s.strip() for s in seg.split(".") if s.strip()])
+    # Split on periods and newlines in a single pass
+    sentences = [s for s in (seg.strip() for seg in _SENTENCE_SPLIT_RE.split(text)) if s]
     if not sentences:
         return text.strip()[:300]
 
-    q_tokens = set(normalize_answer(question).split())
     if not q_tokens:
         return sentences[0][:300]
 
     best_s = sentences[0]
     best_score = -1
+    seen = set()
     for s in sentences:
-        s_tokens = set(normalize_answer(s).split())
+        s_tokens = frozenset(normalize_answer(s).split())
+        # A repeated token set scores the same and can never beat the earlier sentence
+        if s_tokens in seen:
+            continue
+        seen.add(s_tokens)
         overlap = len(q_tokens & s_tokens)
         if overlap > best_score:
             best_score = overlap
@@ -61,28 +85,162 @@ def best_sentence_from_text(text: str, question: str) -> str:
     return best_s[:600]
 
 
-def pick_answer_from_retrieval(retrieved_items: List[Dict[str, Any]], question: str) -> str:
+def pick_answer_from_retrieval(retrieved_items: List[Dict[str, Any]], q_tokens: frozenset[str]) -> str:
     """Return the best sentence from the top-1 chunk as the answer candidate."""
     if not retrieved_items:
         return ""
     top = retrieved_items[0]
-    return best_sentence_from_text(top.get("text", ""), question)
+    return best_sentence_from_text(top.get("text", ""), q_tokens)
+
+
+def bounded_map(pool: ProcessPoolExecutor, fn, *iterables, window: int = 4096, chunksize: int = 64):
+    """Ordered pool.map over zipped iterables, submitting at most `window` items at a time.
+    Executor.map submits every item up front, which pickles the whole run into the call queue at once."""
+    args = zip(*iterables)
+    while batch := list(islice(args, window)):
+        yield from pool.map(fn, *zip(*batch), chunksize=chunksize)
+
+
+def score_one(ex: Dict[str, Any], retrieved: List[Dict[str, Any]], k: int, q_tokens: frozenset[str],
+              pred: str | None = None, ranking: Tuple[float, float, float] | None = None) -> Dict[str, Any]:
+    """Compute all metrics for one sample and return its record.
+    Pure function (no retriever/index state) so it can run in worker processes.
+    If pred is empty, the retrieval heuristic answer is used.
+    ranking is a precomputed (hit, mrr, ndcg) from ranking_metrics; computed per item when omitted.
+    """
+    question = ex["question"]; gold = ex["answer"]
+    relevant_sources: Set[str] = set(ex.get("relevant_sources", []))
+    if not pred:
+        pred = pick_answer_from_retrieval(retrieved, q_tokens)
+
+    # Metrics
+    em = em_score(pred, gold)
+    f1 = f1_score_squad(pred, gold)
+    r = rouge_scores(pred, gold)
+
+    if ranking is not None:
+        hit, mrr, ndcg = ranking
+    else:
+        hit = is_hit(retrieved, relevant_sources)
+        rank = first_relevant_rank(retrieved, relevant_sources)
+        mrr = 0.0 if rank == float('inf') else 1.0 / rank
+        ndcg = ndcg_at_k(retrieved, relevant_sources, k)
+    oracle = oracle_answerable(retrieved, gold)
+
+    return {
+        "id": ex["id"],
+        "case_name": ex["case_name"],
+        "em": em,
+        "f1": f1,
+        "rouge1": r["rouge1"],
+        "rouge2": r["rouge2"],
+        "rougeL": r["rougeL"],
+        "hit@k": hit,
+        "mrr": mrr,
+        "ndcg": ndcg,
+        "oracle@k": oracle,
+        "pred": pred,
+        "gold": gold,
+        "question": question,
+        "relevant_sources": list(relevant_sources),
+        "retrieved": [
+            {
+                "source": it.get("metadata", {}).get("source"),
+                "score": it.get("score"),
+                "text": it.get("text"),
+            } for it in retrieved
+        ],
+    }
+
+
+# ----------------------------
+# Streaming record output
+# ----------------------------
+
+# Aggregate column -> per-record metric key
+AGG_METRICS = {
+    "EM": "em",
+    "F1": "f1",
+    "ROUGE1": "rouge1",
+    "ROUGE2": "rouge2",
+    "ROUGEL": "rougeL",
+    "Hit@k": "hit@k",
+    "MRR": "mrr",
+    "nDCG": "ndcg",
+    "Oracle@k": "oracle@k",
+}
+
+
+class RecordWriter:
+    """Write per-sample records to records.jsonl and per_record.csv as they arrive,
+    keeping only running metric sums so full records (with retrieved texts) are never held in memory.
+    """
+
+    def __init__(self, run_dir: Path):
+        ensure_dir(run_dir)
+        self._jsonl = open(run_dir / "records.jsonl", "wb")
+        self._csv_file = open(run_dir / "per_record.csv", "w", encoding="utf-8", newline="")
+        self._csv: csv.DictWriter | None = None
+        self.n = 0
+        self._sums = dict.fromkeys(AGG_METRICS, 0.0)
+
+    def write(self, rec: Dict[str, Any]):
+        self._jsonl.write(json_line(rec))
+        if self._csv is None:
+            self._csv = csv.DictWriter(self._csv_file, fieldnames=list(rec.keys()))
+            self._csv.writeheader()
+        self._csv.writerow(rec)
+        self.n += 1
+        for name, key in AGG_METRICS.items():
+            self._sums[name] += rec[key]
+
+    def aggregate(self) -> Dict[str, Any]:
+        agg: Dict[str, Any] = {"N": self.n}
+        for name in AGG_METRICS:
+            agg[name] = self._sums[name] / self.n if self.n else 0.0
+        return agg
+
+    def close(self):
+        self._jsonl.close()
+        self._csv_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 # ----------------------------
 # HyDE: Hypothetical Document Embeddings
 # ----------------------------
 
-def generate_hypothetical_answer(question: str, model_name: str) -> str:
-    """Generates a hypothetical answer using a Gemini model for HyDE."""
-    try:
-        model = genai.GenerativeModel(model_name)
-        prompt = f"Please write a short, hypothetical answer to the following legal question. This will be used for a vector search, so focus on relevant legal concepts and terminology.\n\nQuestion: {question}\n\nHypothetical Answer:"
-        response = model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        print(f"Warning: HyDE generation failed for question '{question[:50]}...'. Error: {e}. Falling back to original question.")
-        return question # Fallback to original question
+HYDE_PROMPT = "Please write a short, hypothetical answer to the following legal question. This will be used for a vector search, so focus on relevant legal concepts and terminology.\n\nQuestion: {question}\n\nHypothetical Answer:"
+
+def hyde_cache_key(question: str, model_name: str) -> str:
+    """Cache key for one HyDE text: hash of the question, prompt template and model, so editing or
+    reordering the dataset, or changing the prompt or model, never reuses a stale answer."""
+    payload = json.dumps([question, HYDE_PROMPT, model_name])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def run_hyde_batch(questions: List[str], model_name: str, concurrency: int = 32) -> List[str]:
+    """Generate HyDE answers for many questions concurrently using Gemini's async API.
+    Results keep input order; failures fall back to the original question.
+    """
+    model = genai.GenerativeModel(model_name)
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def _one(question: str) -> str:
+        async with sem:
+            try:
+                response = await model.generate_content_async(HYDE_PROMPT.format(question=question))
+                return response.text
+            except Exception as e:
+                print(f"Warning: HyDE generation failed for question '{question[:50]}...'. Error: {e}. Falling back to original question.")
+                return question
+
+    return list(await asyncio.gather(*(_one(q) for q in questions)))
 
 
 # ----------------------------
@@ -110,9 +268,15 @@ def main():
     # Retrieval/embeddings options
     parser.add_argument("--embed_model", type=str, default="sentence-transformers/all-MiniLM-L6-v2", help="Embedding model to use for queries (must match index build model)")
     parser.add_argument("--e5_instructions", action="store_true", help="Prefix queries with 'query: ' (for E5-style models)")
+    parser.add_argument("--fp16", action="store_true", help="Encode queries in FP16 (GPU only)")
+    parser.add_argument("--int8", action="store_true", help="Encode queries with dynamic INT8 quantization (CPU only)")
+    parser.add_argument("--faiss_gpu", action="store_true", help="Search the FAISS indexes on GPU 0 (requires faiss-gpu)")
+    parser.add_argument("--faiss_gpu_fp16", action="store_true", help="Store GPU FAISS vectors in float16 to save GPU memory")
+    parser.add_argument("--faiss_parallel_mode", type=int, default=None, choices=[0, 1, 2, 3], help="FAISS IVF parallel_mode (2 threads over inverted lists for single-query search; default leaves FAISS's batch-parallel mode)")
     # Debugging options
     parser.add_argument("--debug", action="store_true", help="Dump diagnostic retrieval/matching info for a sample of queries")
     parser.add_argument("--debug_n", type=int, default=25, help="Number of samples to include in debug dump")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes for per-sample metric scoring (1 = serial; always serial with --debug)")
     # Optional LLM evaluation via Gemini
     parser.add_argument("--use_llm", action="store_true", help="Enable LLM evaluation using Gemini with retrieved passages")
     parser.add_argument("--use_hyde", action="store_true", help="Enable query transformation using Hypothetical Document Embeddings (HyDE) with Gemini")
@@ -120,6 +284,8 @@ def main():
     parser.add_argument("--model_name", type=str, default="gemini-2.5-pro", help="Gemini model name (e.g., gemini-1.5-flash, gemini-1.5-pro)")
     parser.add_argument("--max_output_tokens", type=int, default=512)
     parser.add_argument("--max_passages", type=int, default=10, help="Max passages to include in the prompt (from both stores combined)")
+    parser.add_argument("--llm_concurrency", type=int, default=8, help="Max concurrent Gemini requests during LLM evaluation")
+    parser.add_argument("--hyde_concurrency", type=int, default=32, help="Max concurrent Gemini requests when generating HyDE queries")
     args = parser.parse_args()
 
     # Configure Gemini API key if HyDE or LLM eval is used
@@ -183,21 +349,44 @@ def main():
         "catalog_sizes": {"acts": len(cat_a), "judgments": len(cat_b), "union": len(combined_catalog)},
     })
 
-    # Initialize retrievers (embeddings will be loaded once per retriever)
+    # Initialize retrievers; the query embedding model is loaded once and shared by both stores
+    print(f"Loading embedding model: {args.embed_model}")
+    embedder = load_embedder(args.embed_model, fp16=args.fp16, int8=args.int8)
     print(f"Loading FAISS retriever A from: {faiss_a}")
-    retrieverA = FaissRetriever(str(faiss_a), embed_model=args.embed_model)
+    retrieverA = FaissRetriever(str(faiss_a), embed_model=args.embed_model, use_gpu=args.faiss_gpu, gpu_fp16=args.faiss_gpu_fp16, parallel_mode=args.faiss_parallel_mode, embedder=embedder)
     print(f"Loading FAISS retriever B from: {faiss_b}")
-    retrieverB = FaissRetriever(str(faiss_b), embed_model=args.embed_model)
+    retrieverB = FaissRetriever(str(faiss_b), embed_model=args.embed_model, use_gpu=args.faiss_gpu, gpu_fp16=args.faiss_gpu_fp16, parallel_mode=args.faiss_parallel_mode, embedder=embedder)
+
+    # HyDE queries are generated once per sample up front and reused by every store, k and the LLM pass.
+    # They are persisted to outdir so reruns (other k's, other stores) skip the Gemini calls entirely.
+    hyde_cache: Dict[str, str] = {}  # sample id -> HyDE text for this run
+    if args.use_hyde:
+        hyde_cache_path = outdir / "hyde_cache.json"
+        stored: Dict[str, str] = {}  # hyde_cache_key -> HyDE text, across runs
+        if hyde_cache_path.exists():
+            stored = dict(json_loads(hyde_cache_path.read_bytes()).get("entries", {}))
+        keys = {ex["id"]: hyde_cache_key(ex["question"], args.model_name) for ex in samples}
+        hyde_cache = {sid: stored[key] for sid, key in keys.items() if key in stored}
+        if hyde_cache:
+            print(f"Loaded {len(hyde_cache)} cached HyDE queries from {hyde_cache_path}")
+        missing = [ex for ex in samples if ex["id"] not in hyde_cache]
+        if missing:
+            print(f"Generating HyDE queries for {len(missing)} samples (concurrency={args.hyde_concurrency}) ...")
+            hyde_texts = asyncio.run(run_hyde_batch([ex["question"] for ex in missing], args.model_name, concurrency=args.hyde_concurrency))
+            for ex, text in zip(missing, hyde_texts):
+                hyde_cache[ex["id"]] = text
+                # Fallbacks (text == question) are not persisted so a later run retries them
+                if text != ex["question"]:
+                    stored[keys[ex["id"]]] = text
+            save_json(hyde_cache_path, {"entries": stored})
 
     # Optional debug: dump first N samples with retrieved lists and overlaps
     if args.debug:
         dbg_path = outdir / "debug_overview.jsonl"
         print(f"Debug enabled: writing per-sample retrieval diagnostics to {dbg_path}")
-        with open(dbg_path, "w", encoding="utf-8") as fdbg:
+        with open(dbg_path, "wb") as fdbg:
             for ex in samples[: max(1, args.debug_n)]:
-                qtext = ex["question"]
-                if args.use_hyde:
-                    qtext = generate_hypothetical_answer(ex["question"], args.model_name)
+                qtext = hyde_cache.get(ex["id"], ex["question"])
                 if args.e5_instructions:
                     qtext = "query: " + qtext
                 topk = 10
@@ -219,194 +408,121 @@ def main():
                     "a_intersection": inter_a,
                     "b_intersection": inter_b,
                 }
-                fdbg.write(json.dumps(rec, ensure_ascii=False) + "\n")
-
-    def evaluate_store(store_name: str, retriever: FaissRetriever, k_list: List[int]):
+                fdbg.write(json_line(rec))
+
+    def build_query(ex: Dict[str, Any]) -> str:
+        # Determine query text: original question or hypothetical answer
+        return hyde_cache.get(ex["id"], ex["question"])
+
+    # Both stores share the query embedding model, so encode every query once up front
+    query_texts = [build_query(ex) for ex in tqdm(samples, desc="Building queries")]
+    print(f"Encoding {len(query_texts)} queries with {args.embed_model} ...")
+    query_vecs = embed_queries(query_texts, embedder, e5=args.e5_instructions)
+
+    # Retrieve once per store at the largest k; every smaller k is a prefix of these lists.
+    # Shared by the per-store evaluation and the combined LLM evaluation.
+    k_max = max(args.k)
+    print(f"Batched retrieval of {len(query_vecs)} queries at k={k_max} from both stores ...")
+    retrieved_a_all = retrieverA.search_vectors(query_vecs, k=k_max)
+    retrieved_b_all = retrieverB.search_vectors(query_vecs, k=k_max)
+
+    # Question tokens are invariant per sample; compute them once for all stores and k's
+    question_tokens_cache: Dict[str, frozenset[str]] = {ex["id"]: question_tokens(ex["question"]) for ex in samples}
+    q_tokens_all = [question_tokens_cache[ex["id"]] for ex in samples]
+    relevant_all = [set(ex.get("relevant_sources", [])) for ex in samples]
+
+    def evaluate_store(store_name: str, retrieved_all: List[List[Dict[str, Any]]], k_list: List[int]):
         all_results = {}
+        # Hit/MRR/nDCG for every k come from one relevance mask over the shared max-k results
+        rel_mask = relevance_matrix(retrieved_all, relevant_all, k_max)
         for k in k_list:
-            records = []
             desc = f"{store_name} k={k}"
             if args.use_hyde:
                 desc += " (HyDE)"
-            for ex in tqdm(samples, desc=desc):
-                qid = ex["id"]; question = ex["question"]; gold = ex["answer"]
-                relevant_sources: Set[str] = set(ex.get("relevant_sources", []))
-
-                # Determine query text: original question or hypothetical answer
-                query_text = question
-                if args.use_hyde:
-                    query_text = generate_hypothetical_answer(question, args.model_name)
-                if args.e5_instructions:
-                    query_text = "query: " + query_text
-
-                retrieved = retriever.retrieve(query_text, k=k)
-                pred = pick_answer_from_retrieval(retrieved, question)
-
-                # Metrics
-                em = em_score(pred, gold)
-                f1 = f1_score_squad(pred, gold)
-                r = rouge_scores(pred, gold)
-
-                hit = is_hit(retrieved, relevant_sources)
-                rank = first_relevant_rank(retrieved, relevant_sources)
-                mrr = 0.0 if rank == float('inf') else 1.0 / rank
-                ndcg = ndcg_at_k(retrieved, relevant_sources, k)
-                oracle = oracle_answerable(retrieved, gold)
-
-                records.append({
-                    "id": qid,
-                    "case_name": ex["case_name"],
-                    "em": em,
-                    "f1": f1,
-                    "rouge1": r["rouge1"],
-                    "rouge2": r["rouge2"],
-                    "rougeL": r["rougeL"],
-                    "hit@k": hit,
-                    "mrr": mrr,
-                    "ndcg": ndcg,
-                    "oracle@k": oracle,
-                    "pred": pred,
-                    "gold": gold,
-                    "question": question,
-                    "relevant_sources": list(relevant_sources),
-                    "retrieved": [
-                        {
-                            "source": it.get("metadata", {}).get("source"),
-                            "score": it.get("score"),
-                            "text": it.get("text"),
-                        } for it in retrieved
-                    ],
-                })
-
-            # Aggregate
-            agg = {
-                "N": len(records),
-                "EM": mean(r["em"] for r in records) if records else 0.0,
-                "F1": mean(r["f1"] for r in records) if records else 0.0,
-                "ROUGE1": mean(r["rouge1"] for r in records) if records else 0.0,
-                "ROUGE2": mean(r["rouge2"] for r in records) if records else 0.0,
-                "ROUGEL": mean(r["rougeL"] for r in records) if records else 0.0,
-                "Hit@k": mean(r["hit@k"] for r in records) if records else 0.0,
-                "MRR": mean(r["mrr"] for r in records) if records else 0.0,
-                "nDCG": mean(r["ndcg"] for r in records) if records else 0.0,
-                "Oracle@k": mean(r["oracle@k"] for r in records) if records else 0.0,
-            }
-
-            all_results[k] = {"aggregate": agg, "records": records}
-
-            # Save
             run_name = f"{store_name}_k{k}"
             if args.use_hyde:
                 run_name += "_hyde"
             run_dir = outdir / run_name
-            ensure_dir(run_dir)
+
+            retrieved_k = [r[:k] for r in retrieved_all]
+            hit, mrr, ndcg = ranking_metrics(rel_mask, k)
+            ranking_k = list(zip(hit.tolist(), mrr.tolist(), ndcg.tolist()))
+            if pool is not None:
+                scored = bounded_map(pool, score_one, samples, retrieved_k, repeat(k), q_tokens_all, repeat(None),
+                                     ranking_k)
+            else:
+                scored = (
+                    score_one(ex, retrieved, k, q_tokens, ranking=ranking)
+                    for ex, retrieved, q_tokens, ranking in zip(samples, retrieved_k, q_tokens_all, ranking_k)
+                )
+            # Records are streamed to disk as they are scored; only running metric sums stay in memory
+            with RecordWriter(run_dir) as writer:
+                for rec in tqdm(scored, total=len(samples), desc=desc):
+                    writer.write(rec)
+            agg = writer.aggregate()
+            all_results[k] = {"aggregate": agg}
             save_json(run_dir / "aggregate.json", agg)
-            # Also save CSV of per-record metrics
-            df = pd.DataFrame(records)
-            df.to_csv(run_dir / "per_record.csv", index=False)
-            # Save full records with retrieved contexts as JSONL
-            with open(run_dir / "records.jsonl", "w", encoding="utf-8") as f:
-                for r in records:
-                    f.write(json.dumps(r, ensure_ascii=False) + "\n")
         return all_results
 
-    results_a = evaluate_store("StoreA_Acts", retrieverA, args.k)
-    results_b = evaluate_store("StoreB_Judgments", retrieverB, args.k)
+    # Per-sample scoring is CPU-bound and independent across samples, so fan it out over processes
+    pool = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 and not args.debug else None
+    try:
+        results_a = evaluate_store("StoreA_Acts", retrieved_a_all, args.k)
+        results_b = evaluate_store("StoreB_Judgments", retrieved_b_all, args.k)
+    finally:
+        if pool is not None:
+            pool.shutdown()
 
     # Optional: LLM evaluation combining both stores' passages
     llm_results = {}
     if args.use_llm:
         def evaluate_llm_combined(k_list: List[int]):
             all_results = {}
+            # The capped passage list only depends on how many hits each store contributes, so k's that
+            # hit the max_passages cap share the same prompt. Keyed by (qid, n_from_a, n_from_b).
+            prompt_cache: Dict[Tuple[str, int, int], Tuple[List[Dict[str, Any]], str]] = {}
             for k in k_list:
-                records = []
                 desc = f"LLM Gemini {args.model_name} k={k}"
                 if args.use_hyde:
                     desc += " (HyDE)"
-                for ex in tqdm(samples, desc=desc):
-                    qid = ex["id"]; question = ex["question"]; gold = ex["answer"]
-                    relevant_sources: Set[str] = set(ex.get("relevant_sources", []))
-
-                    # Determine query text: original question or hypothetical answer
-                    query_text = question
-                    if args.use_hyde:
-                        query_text = generate_hypothetical_answer(question, args.model_name)
-
-                    # Retrieve from both stores; take top-k from each then cap to max_passages
-                    ret_a = retrieverA.retrieve(query_text, k=k)
-                    ret_b = retrieverB.retrieve(query_text, k=k)
-                    combined = ret_a + ret_b
-                    combined = combined[: args.max_passages] if len(combined) > args.max_passages else combined
-
-                    passages_block = build_passage_block(combined)
-                    prompt = CITATION_PROMPT.format(question=question, passages=passages_block)
-                    pred = gemini_generate(prompt, api_key=args.gemini_key or None, model_name=args.model_name, max_output_tokens=args.max_output_tokens)
-                    if not pred:
-                        # Fallback to heuristic if LLM call fails
-                        pred = pick_answer_from_retrieval(combined, question)
-
-                    # Metrics
-                    em = em_score(pred, gold)
-                    f1 = f1_score_squad(pred, gold)
-                    r = rouge_scores(pred, gold)
-
-                    hit = is_hit(combined, relevant_sources)
-                    rank = first_relevant_rank(combined, relevant_sources)
-                    mrr = 0.0 if rank == float('inf') else 1.0 / rank
-                    ndcg = ndcg_at_k(combined, relevant_sources, min(k, args.max_passages))
-                    oracle = oracle_answerable(combined, gold)
-
-                    records.append({
-                        "id": qid,
-                        "case_name": ex["case_name"],
-                        "em": em,
-                        "f1": f1,
-                        "rouge1": r["rouge1"],
-                        "rouge2": r["rouge2"],
-                        "rougeL": r["rougeL"],
-                        "hit@k": hit,
-                        "mrr": mrr,
-                        "ndcg": ndcg,
-                        "oracle@k": oracle,
-                        "pred": pred,
-                        "gold": gold,
-                        "question": question,
-                        "relevant_sources": list(relevant_sources),
-                        "retrieved": [
-                            {
-                                "source": it.get("metadata", {}).get("source"),
-                                "score": it.get("score"),
-                                "text": it.get("text"),
-                            } for it in combined
-                        ],
-                    })
-
-                agg = {
-                    "N": len(records),
-                    "EM": mean(r["em"] for r in records) if records else 0.0,
-                    "F1": mean(r["f1"] for r in records) if records else 0.0,
-                    "ROUGE1": mean(r["rouge1"] for r in records) if records else 0.0,
-                    "ROUGE2": mean(r["rouge2"] for r in records) if records else 0.0,
-                    "ROUGEL": mean(r["rougeL"] for r in records) if records else 0.0,
-                    "Hit@k": mean(r["hit@k"] for r in records) if records else 0.0,
-                    "MRR": mean(r["mrr"] for r in records) if records else 0.0,
-                    "nDCG": mean(r["ndcg"] for r in records) if records else 0.0,
-                    "Oracle@k": mean(r["oracle@k"] for r in records) if records else 0.0,
-                }
-
-                all_results[k] = {"aggregate": agg, "records": records}
-
+                # Pass 1: build (or reuse) prompts for every sample from the shared retrieval results
+                combined_all = []
+                prompts = []
+                for ex, ret_a_max, ret_b_max in zip(tqdm(samples, desc=desc), retrieved_a_all, retrieved_b_all):
+                    # Top-k from each store, store A first, capped to max_passages
+                    n_a = min(k, len(ret_a_max), args.max_passages)
+                    n_b = min(k, len(ret_b_max), args.max_passages - n_a)
+                    key = (ex["id"], n_a, n_b)
+                    cached = prompt_cache.get(key)
+                    if cached is None:
+                        combined = ret_a_max[:n_a] + ret_b_max[:n_b]
+                        prompt = CITATION_PROMPT.format(question=ex["question"], passages=build_passage_block(combined))
+                        cached = prompt_cache[key] = (combined, prompt)
+                    combined_all.append(cached[0])
+                    prompts.append(cached[1])
+
+                # Pass 2: fan the Gemini calls out concurrently (network-bound)
+                print(f"Generating {len(prompts)} answers with up to {args.llm_concurrency} concurrent requests ...")
+                preds = asyncio.run(gemini_generate_many(
+                    prompts,
+                    api_key=args.gemini_key or None,
+                    model_name=args.model_name,
+                    max_output_tokens=args.max_output_tokens,
+                    concurrency=args.llm_concurrency,
+                ))
+
+                # Pass 3: score (empty preds fall back to the retrieval heuristic) and stream records to disk
                 run_name = f"LLM_Gemini_{args.model_name.replace('/', '_')}_k{k}"
                 if args.use_hyde:
                     run_name += "_hyde"
                 run_dir = outdir / run_name
-                ensure_dir(run_dir)
+                ndcg_k = min(k, args.max_passages)
+                with RecordWriter(run_dir) as writer:
+                    for ex, combined, pred, q_tokens in zip(samples, combined_all, preds, q_tokens_all):
+                        writer.write(score_one(ex, combined, ndcg_k, q_tokens, pred=pred))
+                agg = writer.aggregate()
+                all_results[k] = {"aggregate": agg}
                 save_json(run_dir / "aggregate.json", agg)
-                df = pd.DataFrame(records)
-                df.to_csv(run_dir / "per_record.csv", index=False)
-                with open(run_dir / "records.jsonl", "w", encoding="utf-8") as f:
-                    for r in records:
-                        f.write(json.dumps(r, ensure_ascii=False) + "\n")
             return all_results
 
         llm_results = evaluate_llm_combined(args.k)
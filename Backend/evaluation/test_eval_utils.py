@@ -0,0 +1,68 @@
+import math
+import random
+from collections import Counter
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("rapidfuzz")
+pytest.importorskip("rouge_score")
+pytest.importorskip("torch")
+pytest.importorskip("langchain_community")
+
+from eval_utils import (
+    normalize_answer, _tok_counter, f1_from_prepared, f1_score_squad,
+    is_hit, first_relevant_rank, ndcg_at_k, relevance_matrix, ranking_metrics,
+)
+
+
+def _f1_reference(pred, gold):
+    """f1_score_squad as it was before tokens were cached and prepared once."""
+    pred_tokens = normalize_answer(pred).split()
+    gold_tokens = normalize_answer(gold).split()
+    common = Counter(pred_tokens) & Counter(gold_tokens)
+    num_same = sum(common.values())
+    if len(pred_tokens) == 0 or len(gold_tokens) == 0:
+        return float(pred_tokens == gold_tokens)
+    if num_same == 0:
+        return 0.0
+    precision = 1.0 * num_same / len(pred_tokens)
+    recall = 1.0 * num_same / len(gold_tokens)
+    return (2 * precision * recall) / (precision + recall)
+
+
+def _random_answer(rng):
+    vocab = ["the", "a", "court", "held", "that", "Section", "302", "IPC,", "appeal", "dismissed.", "an", "bail"]
+    return " ".join(rng.choices(vocab, k=rng.randint(0, 12)))
+
+
+def test_f1_matches_reference():
+    rng = random.Random(0)
+    for _ in range(2000):
+        pred, gold = _random_answer(rng), _random_answer(rng)
+        assert f1_score_squad(pred, gold) == _f1_reference(pred, gold)
+        assert f1_from_prepared(*_tok_counter(pred), *_tok_counter(gold)) == _f1_reference(pred, gold)
+
+
+def _random_run(rng, n, k):
+    sources = [f"data_corpus/Judgments/{i}.pdf" for i in range(30)]
+    retrieved_all = [
+        [{"metadata": {"source": rng.choice(sources)}} for _ in range(rng.randint(0, k))]
+        for _ in range(n)
+    ]
+    relevant_all = [set(rng.sample(sources, rng.randint(0, 3))) for _ in range(n)]
+    return retrieved_all, relevant_all
+
+
+@pytest.mark.parametrize("k", [1, 3, 5, 10])
+def test_ranking_metrics_match_per_item_functions(k):
+    rng = random.Random(k)
+    k_max = 10
+    retrieved_all, relevant_all = _random_run(rng, 500, k_max)
+    hit, mrr, ndcg = ranking_metrics(relevance_matrix(retrieved_all, relevant_all, k_max), k)
+    for i, (items, relevant) in enumerate(zip(retrieved_all, relevant_all)):
+        items = items[:k]
+        rank = first_relevant_rank(items, relevant)
+        assert hit[i] == is_hit(items, relevant)
+        assert mrr[i] == pytest.approx(0.0 if rank == math.inf else 1.0 / rank)
+        assert ndcg[i] == pytest.approx(ndcg_at_k(items, relevant, k))
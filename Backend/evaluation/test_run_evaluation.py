@@ -0,0 +1,55 @@
+import csv
+import json
+import random
+from statistics import mean
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+pytest.importorskip("google.generativeai")
+pytest.importorskip("torch")
+pytest.importorskip("langchain_community")
+
+from run_evaluation import AGG_METRICS, HYDE_PROMPT, RecordWriter, hyde_cache_key
+
+
+def _random_record(rng, i):
+    rec = {"id": f"q{i}", "case_name": f"Case {i}"}
+    for key in AGG_METRICS.values():
+        rec[key] = rng.random() if key not in ("em", "hit@k", "oracle@k") else float(rng.random() < 0.5)
+    return rec
+
+
+@pytest.mark.parametrize("n", [0, 1, 257])
+def test_record_writer_matches_in_memory_aggregate(tmp_path, n):
+    rng = random.Random(n)
+    records = [_random_record(rng, i) for i in range(n)]
+    with RecordWriter(tmp_path) as writer:
+        for rec in records:
+            writer.write(rec)
+    agg = writer.aggregate()
+
+    # The aggregate as computed before records were streamed: statistics.mean over the full list
+    assert agg["N"] == len(records)
+    for name, key in AGG_METRICS.items():
+        assert agg[name] == pytest.approx(mean(r[key] for r in records) if records else 0.0)
+
+    with open(tmp_path / "records.jsonl", encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == records
+    with open(tmp_path / "per_record.csv", encoding="utf-8", newline="") as f:
+        assert len(list(csv.DictReader(f))) == len(records)
+
+
+def test_hyde_cache_key_depends_on_question_prompt_and_model(monkeypatch):
+    key = hyde_cache_key("Is anticipatory bail available?", "gemini-1.5-pro")
+    assert key == hyde_cache_key("Is anticipatory bail available?", "gemini-1.5-pro")
+    assert key != hyde_cache_key("Is anticipatory bail available? ", "gemini-1.5-pro")
+    assert key != hyde_cache_key("Is anticipatory bail available?", "gemini-1.5-flash")
+    monkeypatch.setattr("run_evaluation.HYDE_PROMPT", HYDE_PROMPT + " ")
+    assert key != hyde_cache_key("Is anticipatory bail available?", "gemini-1.5-pro")
+
+
+def test_hyde_cache_key_fields_do_not_run_together():
+    # Keys hash a JSON list, so moving text between fields changes the key
+    assert hyde_cache_key("ab", "c") != hyde_cache_key("a", "bc")
@@ -0,0 +1,66 @@
+import os
+import hashlib
+import sqlite3
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Optional: xxhash for cache keys; hashlib.blake2b is the fallback
+try:
+    import xxhash  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    xxhash = None  # type: ignore
+
+# SQLite's default limit on host parameters per statement
+_SQL_PARAM_LIMIT = 900
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an Embeddings model with an on-disk store of document vectors keyed on a hash of the text.
+    Chunks embedded before (by an earlier run, or repeated across Acts and Judgments) skip tokenization
+    and the forward pass. One SQLite file per namespace, which should name the model and backend."""
+
+    def __init__(self, inner, cache_dir, namespace):
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(cache_dir, namespace.replace("/", "__") + ".sqlite")
+        self.inner = inner
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS vecs (key BLOB PRIMARY KEY, vec BLOB NOT NULL)")
+
+    @staticmethod
+    def _key(text):
+        data = text.encode("utf-8")
+        return xxhash.xxh3_128_digest(data) if xxhash is not None else hashlib.blake2b(data, digest_size=16).digest()
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        keys = [self._key(t) for t in texts]
+        found = {}
+        for i in range(0, len(keys), _SQL_PARAM_LIMIT):
+            part = keys[i:i + _SQL_PARAM_LIMIT]
+            placeholders = ",".join("?" * len(part))
+            found.update(self.conn.execute(f"SELECT key, vec FROM vecs WHERE key IN ({placeholders})", part))
+
+        # Misses in first-seen order; repeated texts within the batch are embedded once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            vecs = self.inner.embed_documents(list(missing.values()))
+            rows = [(key, np.asarray(v, dtype=np.float32).tobytes()) for key, v in zip(missing, vecs)]
+            self.conn.executemany("INSERT OR REPLACE INTO vecs VALUES (?, ?)", rows)
+            self.conn.commit()
+            found.update(rows)
+        return [np.frombuffer(found[key], dtype=np.float32).tolist() for key in keys]
+
+    def embed_query(self, text):
+        return self.inner.embed_query(text)
+
+
+def with_cache(embeddings, cache_dir, namespace):
+    """Returns `embeddings` wrapped in CachedEmbeddings, or unchanged when no cache_dir is configured."""
+    if not cache_dir:
+        return embeddings
+    print(f"Caching document embeddings in '{cache_dir}' ({namespace}).")
+    return CachedEmbeddings(embeddings, cache_dir, namespace)
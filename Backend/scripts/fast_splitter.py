@@ -0,0 +1,58 @@
+import re
+from bisect import bisect_left, bisect_right
+from heapq import merge
+
+# Same separators, in the same priority order, as RecursiveCharacterTextSplitter
+SEPARATORS = ("\n\n", "\n", ". ", ", ", " ")
+
+# Bump whenever the chunk boundaries split() produces change, so embeddings cached per chunk are rebuilt
+SPLITTER_VERSION = 2
+
+
+def split(text, size=1000, overlap=200, separators=SEPARATORS):
+    """Yields chunks of at most `size` characters. Each chunk ends at the last boundary inside
+    the window of the highest-priority separator that has one (paragraph before line before
+    sentence ...), as RecursiveCharacterTextSplitter does, and the next one starts at the first
+    boundary of that same separator within `overlap` characters of that end; falls back to a hard
+    cut when no separator fits. Works on offsets and only slices out the chunk being yielded."""
+    if overlap >= size:
+        raise ValueError(f"overlap ({overlap}) must be smaller than size ({size})")
+    n = len(text)
+    if n <= size:
+        chunk = text.strip()
+        if chunk:
+            yield chunk
+        return
+    by_sep = [[m.end() for m in re.finditer(re.escape(sep), text)] for sep in separators]
+    bounds = list(merge(*by_sep))
+    start = 0
+    while start < n:
+        limit = start + size
+        end = n if limit >= n else limit
+        level = None  # boundaries of the separator the chunk ended on; None for a hard cut
+        if limit < n:
+            for sep_bounds in by_sep:
+                i = bisect_right(sep_bounds, limit) - 1
+                # Boundary must leave room past the overlap, otherwise the window cannot advance
+                if i >= 0 and sep_bounds[i] > start + overlap:
+                    end, level = sep_bounds[i], sep_bounds
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            yield chunk
+        if end >= n:
+            break
+        # Overlap in whole pieces of the same separator, as the recursive splitter does; if the last
+        # piece alone is longer than the overlap there is none. A hard cut overlaps from any boundary.
+        next_start = end - overlap
+        candidates = bounds if level is None else level
+        j = bisect_left(candidates, next_start)
+        if j < len(candidates) and candidates[j] < end:
+            start = candidates[j]
+        else:
+            start = next_start if level is None else end
+
+
+def split_text(text, size=1000, overlap=200):
+    """List form of split(), matching TextSplitter.split_text."""
+    return list(split(text, size, overlap))
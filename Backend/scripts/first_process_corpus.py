@@ -1,12 +1,69 @@
 import os
+import multiprocessing as mp
+from array import array
+from dataclasses import dataclass, field
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+import threading
 from tqdm import tqdm
 import fitz  # PyMuPDF
 from docx import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document as LangchainDocument
-# NEW: OCR import
+from fast_splitter import split_text
+# NEW: OCR import (pytesseract only locates the binary; pages are piped to it directly)
 import pytesseract
-from PIL import Image
+import subprocess
+import pyarrow as pa
+import pyarrow.parquet as pq
+import hashlib
+import json
+
+# Optional: lz4 shrinks the extracted-text cache; plain UTF-8 files are used without it
+try:
+    import lz4.frame as lz4f  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    lz4f = None  # type: ignore
+
+# Keep Tesseract single-threaded, both the tesseract subprocesses (which inherit the environment) and the
+# in-process tesserocr engine (must be set before it is loaded); parallelism comes from running pages side by side
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+# Optional: tesserocr runs Tesseract in-process, keeping the engine and language data loaded across pages;
+# without it each page is piped to a tesseract subprocess
+try:
+    import tesserocr  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    tesserocr = None  # type: ignore
+
+# Optional: blake3 for duplicate-file detection; hashlib.blake2b is the fallback
+try:
+    import blake3  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    blake3 = None  # type: ignore
+
+# Corpus locations, resolved from this file so the producer (this script) and the vector-store builders
+# agree whatever directory they are started from
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(SCRIPTS_DIR)
+ACTS_CORPUS_PATH = os.path.join(BACKEND_DIR, "data_corpus", "Acts")
+JUDGMENTS_CORPUS_PATH = os.path.join(BACKEND_DIR, "data_corpus", "Judgments")
+ACTS_PARQUET_PATH = os.path.join(SCRIPTS_DIR, "processed_documents_acts.parquet")
+JUDGMENTS_PARQUET_PATH = os.path.join(SCRIPTS_DIR, "processed_documents_judgments.parquet")
+
+# Chunking parameters shared by every worker (see fast_splitter.split)
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# Extracted raw text is cached here keyed on the file's SHA-256, so reruns skip MuPDF/OCR/docx even for
+# renamed, copied or re-downloaded files (default scripts/.cache/text; override with CORPUS_CACHE_DIR,
+# TEXT_CACHE_DIR is still honoured)
+TEXT_CACHE_DIR = (os.environ.get("CORPUS_CACHE_DIR") or os.environ.get("TEXT_CACHE_DIR")
+                  or os.path.join(SCRIPTS_DIR, ".cache", "text"))
+# Bump when extraction or OCR settings change so cached text from the old pipeline is not reused
+EXTRACT_VERSION = 5
+# Duplicate-detection fingerprints, keyed on (abspath, mtime_ns, size) so unchanged files are not re-hashed
+HASH_CACHE_FILE = os.path.join(TEXT_CACHE_DIR, "content_hashes.json")
+DEDUP_PREFIX_BYTES = 1 << 20
 
 # Configure Tesseract path for Windows/WSL/Linux so pytesseract can find the binary
 import platform
@@ -58,50 +115,226 @@ def _configure_tesseract_path():
 _configure_tesseract_path()
 
 
+# Pages OCR'd concurrently per PDF. Tesseract runs in a subprocess (or releases the GIL under tesserocr), so
+# threads are enough (files are already spread over a process pool, whose daemon workers cannot start their own pools).
+# A standalone ocr_pdf call gets half the cores; pool workers are resized by _init_worker so that
+# processes x page threads stays at about one OCR job per core.
+OCR_PAGE_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+
+def _init_worker(n_procs: int) -> None:
+    """Pool initializer: splits the cores between the file processes' OCR page pools."""
+    global OCR_PAGE_WORKERS
+    OCR_PAGE_WORKERS = max(1, (os.cpu_count() or 1) // n_procs)
+
+
+def _ocr_one(png_bytes: bytes, lang: str, psm: str) -> str:
+    """Runs the tesseract binary on one PNG page fed over stdin and returns its stdout text."""
+    cmd = [pytesseract.pytesseract.tesseract_cmd, "stdin", "stdout", "-l", lang, "--psm", psm]
+    result = subprocess.run(cmd, input=png_bytes, capture_output=True, check=True)
+    return result.stdout.decode("utf-8", errors="replace")
+
+
+_tess_local = threading.local()
+
+
+def _ocr_one_tesserocr(samples: bytes, width: int, height: int, n: int, stride: int, lang: str, psm: str) -> str:
+    """OCRs one raw grayscale page with this thread's tesserocr engine (engines are not thread-safe,
+    so each OCR thread keeps its own, created on first use and reused for every later page)."""
+    api = getattr(_tess_local, "api", None)
+    if api is None or _tess_local.config != (lang, psm):
+        api = tesserocr.PyTessBaseAPI(lang=lang, psm=int(psm))
+        _tess_local.api, _tess_local.config = api, (lang, psm)
+    api.SetImageBytes(samples, width, height, n, stride)
+    return api.GetUTF8Text()
+
+
+_ocr_executor = None
+
+
+def _ocr_pool() -> ThreadPoolExecutor:
+    """Per-process OCR thread pool, kept for the process lifetime so tesserocr engines stay loaded across files."""
+    global _ocr_executor
+    if _ocr_executor is None:
+        _ocr_executor = ThreadPoolExecutor(max_workers=OCR_PAGE_WORKERS)
+    return _ocr_executor
+
+
+# Scans below this resolution are upsampled to it for OCR (Tesseract loses accuracy on small x-heights)
+OCR_MIN_DPI = 100
+
+
+def _ocr_scale(page, max_scale: float) -> float:
+    """Render zoom for OCR from the page's (largest) embedded scan: its native resolution clamped to
+    [OCR_MIN_DPI, 72 * max_scale]. Pages are never rendered above max_scale, so no page costs more than
+    the fixed-zoom render did, and scans between the two bounds skip interpolated pixels.
+    Pages without image info use max_scale."""
+    native_dpi, best_area = 0.0, 0.0
+    for img in page.get_image_info():
+        x0, y0, x1, y1 = img["bbox"]
+        area = (x1 - x0) * (y1 - y0)
+        if area > best_area and x1 > x0:
+            best_area, native_dpi = area, img["width"] * 72 / (x1 - x0)
+    if not native_dpi:
+        return max_scale
+    return min(max_scale, max(OCR_MIN_DPI, native_dpi) / 72)
+
+
 def ocr_pdf(file_path: str, dpi_scale: float = 2.0, lang: str = "eng") -> str:
-    """Render each PDF page to an image and run Tesseract OCR. Returns concatenated text."""
+    """Render each PDF page to an image and run Tesseract OCR. Returns concatenated text.
+    Each page is rendered at its scan's native resolution, upsampled to OCR_MIN_DPI when below it and
+    capped at dpi_scale (72 DPI * scale); pages without an embedded image use dpi_scale (see _ocr_scale).
+    Pages are OCR'd in parallel; at most 2 * OCR_PAGE_WORKERS rendered pages are held in memory."""
     text_parts = []
+    # You can tweak Tesseract page segmentation mode (psm) if layout is multi-column
+    # common choices: 3 (auto), 4 (column), 6 (block of text)
+    psm = "4"
+    pending = deque()
+
+    def collect(future):
+        page_text = future.result()
+        if page_text:
+            text_parts.append(page_text)
+
+    ex = _ocr_pool()
     doc = fitz.open(file_path)
     try:
-        # Zoom for better OCR accuracy (72 DPI * scale).
-        mat = fitz.Matrix(dpi_scale, dpi_scale)
         for page in doc:
-            pix = page.get_pixmap(matrix=mat, alpha=False)  # render page to raster
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            # You can tweak Tesseract page segmentation mode (psm) if layout is multi-column
-            # common choices: 3 (auto), 4 (column), 6 (block of text)
-            config = "--psm 4"
-            page_text = pytesseract.image_to_string(img, lang=lang, config=config)
-            if page_text:
-                text_parts.append(page_text)
+            # Zoom for better OCR accuracy (72 DPI * scale).
+            scale = _ocr_scale(page, dpi_scale)
+            mat = fitz.Matrix(scale, scale)
+            if tesserocr is not None:
+                # Raw grayscale samples go straight into the in-process engine; no encode/decode at all
+                pix = page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False)
+                pending.append(ex.submit(_ocr_one_tesserocr, pix.samples, pix.width, pix.height, pix.n, pix.stride,
+                                         lang, psm))
+            else:
+                pix = page.get_pixmap(matrix=mat, alpha=False)  # render page to raster
+                # PNG-encode once in MuPDF and pipe it to tesseract; no PIL copy or temp file
+                pending.append(ex.submit(_ocr_one, pix.tobytes("png"), lang, psm))
+            if len(pending) >= 2 * OCR_PAGE_WORKERS:
+                collect(pending.popleft())
+        # Results are collected oldest-first, so page order is preserved
+        while pending:
+            collect(pending.popleft())
     finally:
+        # If rendering raised mid-document, drop the pages still queued on the shared pool
+        for future in pending:
+            future.cancel()
         doc.close()
     return "\n".join(text_parts).strip()
 
 
+def _text_cache_path(file_path: str) -> str:
+    # A full read + SHA-256 (SHA-NI accelerated) is negligible next to the extraction it saves
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while block := f.read(1 << 20):
+            h.update(block)
+    ext = ".txt.lz4" if lz4f is not None else ".txt"
+    # OCR text differs between the in-process and subprocess engines, so the engine is part of the key
+    engine = "-tesserocr" if tesserocr is not None else ""
+    return os.path.join(TEXT_CACHE_DIR, f"{h.hexdigest()}-v{EXTRACT_VERSION}{engine}{ext}")
+
+
+def _read_text_cache(cache_path: str):
+    try:
+        with open(cache_path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if lz4f is not None:
+        data = lz4f.decompress(data)
+    return data.decode("utf-8")
+
+
+def _write_text_cache(cache_path: str, text: str) -> None:
+    data = text.encode("utf-8")
+    if lz4f is not None:
+        data = lz4f.compress(data)
+    os.makedirs(TEXT_CACHE_DIR, exist_ok=True)
+    # Write then rename so concurrent workers never see a partial file
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, cache_path)
+
+
 def load_and_read_doc(file_path):
+    """Returns the document text, from the on-disk text cache when the same content was extracted before."""
+    try:
+        cache_path = _text_cache_path(file_path)
+        text = _read_text_cache(cache_path)
+    except Exception as e:
+        print(f"WARNING: text cache unavailable for {file_path}: {e}")
+        cache_path, text = None, None
+    if text is not None:
+        return text
+
+    text = _extract_text(file_path)
+    if text and cache_path is not None:
+        try:
+            _write_text_cache(cache_path, text)
+        except OSError as e:
+            print(f"WARNING: could not cache text for {file_path}: {e}")
+    return text
+
+
+# Plain-text extraction flags: only clip to the page; no ligature glyph or whitespace-character
+# bookkeeping (ligatures come out expanded, e.g. "fi", which also suits search)
+PDF_TEXT_FLAGS = fitz.TEXT_MEDIABOX_CLIP
+
+
+# Scanned PDFs have no text layer on any page; if the first pages carry (almost) no text,
+# stop extracting and go straight to OCR instead of walking every page's empty text layer.
+TEXT_PROBE_PAGES = 4
+TEXT_PROBE_MIN_CHARS = 20
+
+
+def _read_pdf(file_path):
+    doc = fitz.open(file_path, filetype="pdf")
+    try:
+        # First try native text extraction (fast for digitally generated PDFs).
+        # sort=False keeps MuPDF's stream order and skips its reading-order sort.
+        parts = []
+        probe_chars = 0
+        for i in range(doc.page_count):
+            t = doc.load_page(i).get_text("text", flags=PDF_TEXT_FLAGS, sort=False)
+            parts.append(t)
+            if i < TEXT_PROBE_PAGES:
+                probe_chars += len(t.strip())
+                if i == TEXT_PROBE_PAGES - 1 and probe_chars < TEXT_PROBE_MIN_CHARS:
+                    parts = []
+                    break
+        text = "".join(parts)
+    finally:
+        doc.close()
+
+    # Fallback to OCR if no extractable text
+    if not text or text.isspace():
+        print(f"INFO: No extractable text in {file_path}. Running OCR...")
+        # Adjust language codes as needed: e.g., "eng+hin"
+        text = ocr_pdf(file_path, dpi_scale=2.0, lang="eng")
+    return text
+
+
+def _read_docx(file_path):
+    doc = Document(file_path)
+    return "\n".join(para.text for para in doc.paragraphs)
+
+
+# Extension -> reader; supporting a new format is one entry here
+HANDLERS = {".pdf": _read_pdf, ".docx": _read_docx}
+
+
+def _extract_text(file_path):
     """Loads text from PDF or DOCX file with detailed logging. Falls back to OCR for image PDFs."""
+    reader = HANDLERS.get(os.path.splitext(file_path)[1].lower())
+    if reader is None:
+        print(f"Skipping unsupported file type: {file_path}")
+        return None
     try:
-        if file_path.lower().endswith(".pdf"):
-            doc = fitz.open(file_path)
-            try:
-                # First try native text extraction (fast for digitally generated PDFs)
-                text = "".join(page.get_text() for page in doc)
-            finally:
-                doc.close()
-
-            # Fallback to OCR if no extractable text
-            if not text or text.isspace():
-                print(f"INFO: No extractable text in {file_path}. Running OCR...")
-                # Adjust language codes as needed: e.g., "eng+hin"
-                text = ocr_pdf(file_path, dpi_scale=2.0, lang="eng")
-
-        elif file_path.lower().endswith(".docx"):
-            doc = Document(file_path)
-            text = "\n".join(para.text for para in doc.paragraphs)
-        else:
-            print(f"Skipping unsupported file type: {file_path}")
-            return None
+        text = reader(file_path)
 
         # Final sanity check
         if not text or text.isspace():
@@ -114,43 +347,177 @@ def load_and_read_doc(file_path):
         return None
 
 
-def process_documents_from_path(corpus_path: str) -> list[LangchainDocument]:
-    """Processes all PDF/DOCX files in a directory, chunks them, and returns LangChain Documents."""
-    all_documents = []
+def _process_one(task: tuple[int, str]) -> tuple[int, str, list[str]]:
+    """Reads and splits a single file in a worker; returns (position, path, chunks)."""
+    pos, file_path = task
+    text = load_and_read_doc(file_path)
+    if not text:
+        return pos, file_path, []
+    return pos, file_path, split_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
+
+
+def _iter_files(root: str):
+    """Yields paths of supported files (see HANDLERS) under root. DirEntry carries the path and the dirent type,
+    so no per-entry stat or os.path.join is needed."""
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _iter_files(entry.path)
+            elif entry.is_file(follow_symlinks=False) and os.path.splitext(entry.name)[1].lower() in HANDLERS:
+                yield entry.path
+
+
+def _content_fingerprint(file_path: str, size: int) -> str:
+    """Hash of the first DEDUP_PREFIX_BYTES plus the file size; equal fingerprints are treated as duplicates."""
+    with open(file_path, "rb") as f:
+        head = f.read(DEDUP_PREFIX_BYTES)
+    digest = blake3.blake3(head).hexdigest() if blake3 is not None else hashlib.blake2b(head).hexdigest()
+    return f"{size}:{digest}"
+
+
+def _dedupe_files(file_list: list[str], root: str) -> list[str]:
+    """Drops files whose content fingerprint was already seen in this scan (first occurrence wins).
+    Cached fingerprints under `root` that this scan did not produce (deleted or modified files) are pruned;
+    entries for other corpora sharing the cache file are kept."""
+    try:
+        with open(HASH_CACHE_FILE, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cached = {}
+
+    keys, sizes = [], []
+    for file_path in file_list:
+        st = os.stat(file_path)
+        keys.append(f"{os.path.abspath(file_path)}|{st.st_mtime_ns}|{st.st_size}")
+        sizes.append(st.st_size)
+
+    # Cache misses are pure read+hash work; the hashers release the GIL on large buffers,
+    # so a thread pool overlaps the disk reads. Results stay in input order.
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    with ThreadPoolExecutor(max_workers=min(32, 4 * (os.cpu_count() or 1))) as ex:
+        computed = ex.map(lambda i: _content_fingerprint(file_list[i], sizes[i]), missing)
+        fingerprints = {keys[i]: fp for i, fp in zip(missing, computed)}
+    for key in keys:
+        if key not in fingerprints:
+            fingerprints[key] = cached[key]
+
+    seen = set()
+    unique = []
+    for file_path, key in zip(file_list, keys):
+        fp = fingerprints[key]
+        if fp in seen:
+            continue
+        seen.add(fp)
+        unique.append(file_path)
+
+    try:
+        os.makedirs(TEXT_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{HASH_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            root_prefix = os.path.join(os.path.abspath(root), "")
+            kept = {key: fp for key, fp in cached.items() if not key.startswith(root_prefix)}
+            json.dump({**kept, **fingerprints}, f)
+        os.replace(tmp_path, HASH_CACHE_FILE)
+    except OSError as e:
+        print(f"WARNING: could not save content hash cache: {e}")
+    return unique
+
+
+@dataclass
+class Corpus:
+    """Chunked corpus as parallel columns (text, source, chunk index)."""
+    texts: list[str] = field(default_factory=list)
+    sources: list[str] = field(default_factory=list)
+    indices: array = field(default_factory=lambda: array("i"))
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def extend(self, source: str, chunks: list[str]) -> None:
+        self.texts.extend(chunks)
+        self.sources.extend([source] * len(chunks))
+        self.indices.extend(range(len(chunks)))
+
+    def metadatas(self) -> list[dict]:
+        return [{"source": s, "chunk_number": i} for s, i in zip(self.sources, self.indices)]
+
+
+def source_name(file_path: str) -> str:
+    """Chunk `source` metadata: the file path relative to Backend/ (e.g. data_corpus/Acts/x.pdf), as the
+    stores have always recorded it, independent of the CWD the build was started from."""
+    return os.path.relpath(file_path, BACKEND_DIR)
+
+
+def list_corpus_files(corpus_path: str) -> list[str]:
+    """Supported files under corpus_path in directory-scan order, with duplicate contents dropped."""
+    scanned = list(_iter_files(corpus_path))
+    file_list = _dedupe_files(scanned, corpus_path)
+    if len(file_list) < len(scanned):
+        print(f"Skipping {len(scanned) - len(file_list)} duplicate files.")
+    return file_list
+
+
+def process_documents_from_path(corpus_path: str, max_workers: int | None = None) -> Corpus:
+    """Processes all PDF/DOCX files in a directory, chunks them, and returns them as a Corpus.
+    Files are decoded and split in parallel across processes (defaults to one per CPU)."""
     print(f"Processing documents from: {corpus_path}")
+    file_list = list_corpus_files(corpus_path)
+
+    # imap_unordered hands back each file as soon as a worker finishes it, so one slow OCR job
+    # does not hold back the rest; results are slotted by position to keep the directory-scan order.
+    per_file: list[tuple[str, list[str]] | None] = [None] * len(file_list)
+    n_procs = max_workers or os.cpu_count() or 1
+    with mp.Pool(processes=n_procs, initializer=_init_worker, initargs=(n_procs,)) as pool:
+        results = pool.imap_unordered(_process_one, enumerate(file_list), chunksize=4)
+        for pos, file_path, chunks in tqdm(results, total=len(file_list), desc=f"Reading files in {corpus_path}"):
+            per_file[pos] = (file_path, chunks)
+
+    corpus = Corpus()
+    for file_path, chunks in per_file:
+        corpus.extend(source_name(file_path), chunks)
+
+    print(f"Processed {len(corpus)} document chunks.")
+    return corpus
+
 
-    file_list = []
-    for root, _, files in os.walk(corpus_path):
-        for file in files:
-            file_list.append(os.path.join(root, file))
+def iter_chunks(file_list: list[str], max_workers: int | None = None) -> Iterator[tuple[str, dict]]:
+    """Streaming counterpart of process_documents_from_path: yields (chunk_text, metadata) in
+    file order as workers finish, so only the files in flight are held in memory."""
+    n_procs = max_workers or os.cpu_count() or 1
+    with mp.Pool(processes=n_procs, initializer=_init_worker, initargs=(n_procs,)) as pool:
+        for _, file_path, chunks in pool.imap(_process_one, enumerate(file_list), chunksize=4):
+            source = source_name(file_path)
+            for idx, chunk in enumerate(chunks):
+                yield chunk, {"source": source, "chunk_number": idx}
 
-    for file_path in tqdm(file_list, desc=f"Reading files in {corpus_path}"):
-        text = load_and_read_doc(file_path)
 
-        if text:
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                length_function=len,
-            )
-            chunks = text_splitter.split_text(text)
+def save_corpus_parquet(corpus: Corpus, path: str) -> None:
+    """Writes chunks as a zstd Parquet table with text/source/chunk_index columns."""
+    table = pa.table({
+        "text": pa.array(corpus.texts, type=pa.large_string()),
+        "source": pa.array(corpus.sources, type=pa.string()),
+        "chunk_index": pa.array(corpus.indices, type=pa.int32()),
+    })
+    pq.write_table(table, path, compression="zstd")
 
-            for i, chunk in enumerate(chunks):
-                doc = LangchainDocument(
-                    page_content=chunk,
-                    metadata={"source": file_path, "chunk_number": i},
-                )
-                all_documents.append(doc)
 
-    print(f"Processed {len(all_documents)} document chunks.")
-    return all_documents
+def load_corpus_parquet(path: str) -> Corpus:
+    """Reads a file written by save_corpus_parquet back into columns, without building Documents."""
+    table = pq.read_table(path)
+    return Corpus(
+        texts=table.column("text").to_pylist(),
+        sources=table.column("source").to_pylist(),
+        indices=array("i", table.column("chunk_index").to_pylist()),
+    )
 
 
 if __name__ == "__main__":
     print("Testing processing for Acts...")
-    acts_docs = process_documents_from_path("../data_corpus/Acts")
-    print(f"Found {len(acts_docs)} chunks for Acts.")
+    acts_corpus = process_documents_from_path(ACTS_CORPUS_PATH)
+    print(f"Found {len(acts_corpus)} chunks for Acts.")
+    save_corpus_parquet(acts_corpus, ACTS_PARQUET_PATH)
 
     print("\nTesting processing for Judgments...")
-    judgment_docs = process_documents_from_path("../data_corpus/Judgments")
-    print(f"Found {len(judgment_docs)} chunks for Judgments.")
\ No newline at end of file
+    judgment_corpus = process_documents_from_path(JUDGMENTS_CORPUS_PATH)
+    print(f"Found {len(judgment_corpus)} chunks for Judgments.")
+    save_corpus_parquet(judgment_corpus, JUDGMENTS_PARQUET_PATH)
@@ -0,0 +1,49 @@
+import os
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class OnnxInt8Embeddings(Embeddings):
+    """Sentence-transformer style embeddings (mean pooling + L2 norm) from an INT8 ONNX Runtime session.
+    The model is exported and quantized into `model_dir` on first use."""
+
+    def __init__(self, model_name, model_dir, batch_size=256, max_length=256):
+        try:
+            from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError(
+                "EMBED_BACKEND=onnx-int8 needs optimum with ONNX Runtime: pip install 'optimum[onnxruntime]'"
+            ) from e
+
+        if not os.path.isdir(model_dir):
+            export_dir = f"{model_dir}_fp32"
+            ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(export_dir)
+            qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            ORTQuantizer.from_pretrained(export_dir).quantize(save_dir=model_dir, quantization_config=qconfig)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_dir, file_name="model_quantized.onnx", provider="CPUExecutionProvider"
+        )
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def _encode(self, texts):
+        out = []
+        for i in range(0, len(texts), self.batch_size):
+            enc = self.tokenizer(texts[i:i + self.batch_size], padding=True, truncation=True,
+                                 max_length=self.max_length, return_tensors="np")
+            hidden = self.model(**enc).last_hidden_state
+            mask = enc["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            out.append(pooled.astype(np.float32))
+        return np.concatenate(out)
+
+    def embed_documents(self, texts):
+        return self._encode(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self._encode([text])[0].tolist()
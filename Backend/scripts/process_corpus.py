@@ -1,93 +1,152 @@
 import os
 import fitz  # PyMuPDF
 import json
+import mmap
 import re
-import pickle
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from concurrent.futures import ProcessPoolExecutor
 from langchain.docstore.document import Document
+from fast_splitter import split_text
+
+try:
+    import orjson  # faster JSON parsing for the CaseLawData tree
+except ImportError:
+    orjson = None
+
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 # --- Configuration ---
 ACTS_DIR = "Acts/"
 CASE_LAW_DIR = "CaseLawData/"
-OUTPUT_FILE = "processed_corpus_22_OCT.pkl"
+OUTPUT_FILE = "processed_corpus_22_OCT.parquet"
+MMAP_JSON_THRESHOLD = 4 * 1024 * 1024  # bytes; larger case files are parsed via mmap
+
+# Clip-only text flags: MuPDF skips ligature/whitespace preservation, which plain text does not need
+PDF_TEXT_FLAGS = fitz.TEXT_MEDIABOX_CLIP
+
 
 # --- Text Processing Functions (from your original script) ---
 def extract_text_from_pdf(pdf_path):
-    doc = fitz.open(pdf_path)
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    return text
+    doc = fitz.open(pdf_path, filetype="pdf")
+    try:
+        # Join once instead of repeated += (quadratic on multi-hundred-page acts); sort=False skips
+        # MuPDF's reading-order sort
+        return "".join([
+            doc.load_page(i).get_text("text", flags=PDF_TEXT_FLAGS, sort=False) for i in range(doc.page_count)
+        ])
+    finally:
+        doc.close()
+
+# Blank-line runs and horizontal whitespace runs, collapsed in a single pass
+_RE_CLEAN = re.compile(r'\n\s*\n|[ \t]+')
+
+def _clean_repl(m):
+    return '\n\n' if m.group(0)[0] == '\n' else ' '
 
 def clean_text(text):
-    text = re.sub(r'\n\s*\n', '\n\n', text)
-    text = re.sub(r'[ \t]+', ' ', text)
-    return text.strip()
+    return _RE_CLEAN.sub(_clean_repl, text).strip()
 
 # --- NEW Function to Process Case Law JSON ---
 def extract_text_from_json(json_path):
     """Extracts the main document text from an Indian Kanoon JSON file."""
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(json_path, 'rb') as f:
+            if orjson is None:
+                data = json.load(f)
+            elif os.fstat(f.fileno()).st_size > MMAP_JSON_THRESHOLD:
+                # Parse large files straight from the page cache without an extra copy
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    with memoryview(mm) as buf:
+                        data = orjson.loads(buf)
+            else:
+                data = orjson.loads(f.read())
         # The main judgment text is in the 'doc' key
         return data.get("doc", "")
     except (json.JSONDecodeError, IOError) as e:
         print(f"  Warning: Could not read or parse {json_path}. Skipping. Error: {e}")
         return None
 
+# --- Chunking ---
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+
+# --- Per-file workers (run in a process pool) ---
+def _chunk_documents(raw_text, filename, doc_type):
+    cleaned_text = clean_text(raw_text)
+    chunks = split_text(cleaned_text, CHUNK_SIZE, CHUNK_OVERLAP)
+    return [
+        Document(page_content=chunk_text, metadata={"source": filename, "type": doc_type})
+        for chunk_text in chunks
+    ]
+
+def process_pdf(pdf_path):
+    """Extracts, cleans and chunks one Legal Act PDF."""
+    filename = os.path.basename(pdf_path)
+    print(f"Processing Act: {filename}")
+    return _chunk_documents(extract_text_from_pdf(pdf_path), filename, "Legal Act")
+
+def process_json(json_path):
+    """Extracts, cleans and chunks one Indian Kanoon case JSON."""
+    filename = os.path.basename(json_path)
+    print(f"Processing Case: {filename}")
+    raw_text = extract_text_from_json(json_path)
+    if not raw_text:
+        return []
+    return _chunk_documents(raw_text, filename, "Case Law")
+
+# --- Columnar corpus output ---
+def save_corpus_parquet(documents, path):
+    """Writes chunks as a zstd-compressed Parquet table with text/source/type columns."""
+    table = pa.table({
+        "text": pa.array([d.page_content for d in documents], type=pa.large_string()),
+        "source": pa.array([d.metadata["source"] for d in documents], type=pa.string()),
+        "type": pa.array([d.metadata["type"] for d in documents], type=pa.string()),
+    })
+    pq.write_table(table, path, compression="zstd")
+
+def iter_corpus_batches(path, batch_size=1024):
+    """Streams (texts, metadatas) batches from a corpus Parquet file without loading it whole.
+    Each batch can be fed straight into an embedding model's encode call."""
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        cols = batch.to_pydict()
+        metadatas = [{"source": s, "type": t} for s, t in zip(cols["source"], cols["type"])]
+        yield cols["text"], metadatas
+
+def iter_files(root, suffix, recursive=True):
+    """Yields paths of files under root ending in suffix. os.scandir's DirEntry carries the path and
+    dirent type, so there is no per-entry stat or os.path.join as with os.walk."""
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    yield from iter_files(entry.path, suffix, recursive)
+            elif entry.name.endswith(suffix):
+                yield entry.path
+
 # --- Main Script Logic ---
 if __name__ == "__main__":
     all_documents = []
-
-    # --- Initialize the Text Splitter ---
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=150,
-        separators=["\n\n", "\n", ". ", ", ", " "],
-    )
+    max_workers = os.cpu_count()
 
     # --- 1. Process the original Legal Acts ---
     print("--- Phase 1: Processing Legal Acts ---")
     if os.path.isdir(ACTS_DIR):
-        for filename in os.listdir(ACTS_DIR):
-            if filename.endswith(".pdf"):
-                print(f"Processing Act: {filename}")
-                pdf_path = os.path.join(ACTS_DIR, filename)
-                raw_text = extract_text_from_pdf(pdf_path)
-                cleaned_text = clean_text(raw_text)
-                chunks = text_splitter.split_text(cleaned_text)
-                
-                for i, chunk_text in enumerate(chunks):
-                    doc = Document(
-                        page_content=chunk_text,
-                        metadata={"source": filename, "type": "Legal Act"}
-                    )
-                    all_documents.append(doc)
+        pdf_paths = list(iter_files(ACTS_DIR, ".pdf", recursive=False))
+        # PDF parsing is CPU-bound and independent per file
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for docs in executor.map(process_pdf, pdf_paths, chunksize=4):
+                all_documents.extend(docs)
     else:
         print(f"Warning: Directory '{ACTS_DIR}' not found. Skipping legal acts.")
 
     # --- 2. Process the downloaded Case Law ---
     print("\n--- Phase 2: Processing Case Law ---")
     if os.path.isdir(CASE_LAW_DIR):
-        # The os.walk function is perfect for navigating the deep folder structure
-        for root, dirs, files in os.walk(CASE_LAW_DIR):
-            for filename in files:
-                if filename.endswith(".json"):
-                    print(f"Processing Case: {filename}")
-                    json_path = os.path.join(root, filename)
-                    raw_text = extract_text_from_json(json_path)
-                    
-                    if raw_text:
-                        cleaned_text = clean_text(raw_text)
-                        chunks = text_splitter.split_text(cleaned_text)
-                        
-                        for i, chunk_text in enumerate(chunks):
-                            doc = Document(
-                                page_content=chunk_text,
-                                metadata={"source": filename, "type": "Case Law"}
-                            )
-                            all_documents.append(doc)
+        # Recursive scandir over the deep court/year folder structure
+        json_paths = list(iter_files(CASE_LAW_DIR, ".json"))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for docs in executor.map(process_json, json_paths, chunksize=4):
+                all_documents.extend(docs)
     else:
         print(f"Warning: Directory '{CASE_LAW_DIR}' not found. Skipping case law.")
 
@@ -95,8 +154,8 @@ if __name__ == "__main__":
     print(f"\n--- Finalizing ---")
     print(f"Created a total of {len(all_documents)} document chunks from all sources.")
 
-    with open(OUTPUT_FILE, 'wb') as f:
-        pickle.dump(all_documents, f)
+    save_corpus_parquet(all_documents, OUTPUT_FILE)
 
     print(f"Combined corpus saved to '{OUTPUT_FILE}'.")
-    print("Next step: Run the 'create_vector_store.py' script on this new file to build your final FAISS index.")
\ No newline at end of file
+    print("Read it back batch by batch with iter_corpus_batches. The FAISS stores are built by "
+          "second_build_vector_stores.py (MiniLM) or rebuild_vector_stores_e5.py (E5).")
\ No newline at end of file
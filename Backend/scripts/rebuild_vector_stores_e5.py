@@ -1,11 +1,28 @@
+import os
+import gc
 import time
 import math
+import json
+import hashlib
+import pickle
+import uuid
+from itertools import islice
 from tqdm import tqdm
+import numpy as np
+import faiss
 import torch
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_core.documents import Document as LCDocument
-from first_process_corpus import process_documents_from_path
+from first_process_corpus import (
+    list_corpus_files, iter_chunks, CHUNK_SIZE, CHUNK_OVERLAP, EXTRACT_VERSION,
+    ACTS_CORPUS_PATH, JUDGMENTS_CORPUS_PATH,
+)
+from onnx_embeddings import OnnxInt8Embeddings
+from embedding_cache import with_cache
+from fast_splitter import SPLITTER_VERSION
 
 """
 Rebuild vector stores using a stronger multilingual embedding model (E5).
@@ -32,96 +49,299 @@ Then evaluate (PowerShell):
 """
 
 # --- 1. Paths ---
-ACTS_CORPUS_PATH = "data_corpus/Acts"
-JUDGMENTS_CORPUS_PATH = "data_corpus/Judgments"
 FAISS_ACTS_PATH = "faiss_acts_e5"
 FAISS_JUDGMENTS_PATH = "faiss_judgments_e5"
+E5_MODEL_NAME = "intfloat/multilingual-e5-base"
+# Set EMBED_BACKEND=onnx-int8 to encode CPU-only builds with a dynamically quantized ONNX export
+# (needs optimum[onnxruntime]; vectors differ slightly from FP32, so re-run the evaluation before relying on it)
+EMBED_BACKEND = os.environ.get("EMBED_BACKEND", "torch")
+ONNX_INT8_DIR = os.environ.get("ONNX_INT8_DIR", "onnx_e5_int8")
+# Set EMBED_CACHE_DIR to keep document vectors on disk keyed by chunk hash; reruns only encode new chunks
+EMBED_CACHE_DIR = os.environ.get("EMBED_CACHE_DIR")
+# Set COMPILE_ENCODER=1 to torch.compile the encoder on GPU builds (compile cost amortises over the corpus)
+COMPILE_ENCODER = os.environ.get("COMPILE_ENCODER") == "1"
 
 # --- 2. Embeddings init (GPU-aware) ---
-print("Initializing E5 HuggingFace Embeddings model...")
-model_name = "intfloat/multilingual-e5-base"
-use_cuda = torch.cuda.is_available()
-model_kwargs = {"device": "cuda" if use_cuda else "cpu"}
-# Tune batch size for your GPU/CPU
-encode_kwargs = {"batch_size": 256, "normalize_embeddings": True}
-embeddings = HuggingFaceEmbeddings(model_name=model_name, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs)
-print(f"E5 model initialized on {'CUDA' if use_cuda else 'CPU'}.")
-
-# Optional: prefer TensorFloat32 on Ampere+ for speed
-try:
-    torch.set_float32_matmul_precision("high")
-except Exception:
-    pass
-
-
-def _to_e5_passage_docs(docs: list[LCDocument]) -> list[LCDocument]:
-    out: list[LCDocument] = []
-    for d in docs:
-        # Apply E5 passage instruction prefix
-        content = d.page_content or ""
-        if not content.startswith("passage:"):
-            content = "passage: " + content
-        out.append(LCDocument(page_content=content, metadata=d.metadata))
-    return out
+def compile_encoder(embeddings):
+    """Wraps the transformer inside the SentenceTransformer with torch.compile and runs one warmup batch.
+    dynamic=True because batches are padded to their longest text, so sequence length varies."""
+    st_model = embeddings._client
+    st_model[0].auto_model = torch.compile(st_model[0].auto_model, dynamic=True)
+    embeddings.embed_documents(["passage: warmup"] * 8)
+
+
+def init_embeddings():
+    model_name = E5_MODEL_NAME
+    use_cuda = torch.cuda.is_available()
+    if EMBED_BACKEND == "onnx-int8" and not use_cuda:
+        print(f"Initializing INT8 ONNX Runtime E5 embeddings from '{ONNX_INT8_DIR}'...")
+        # E5 uses mean pooling over up to 512 tokens, same as the SentenceTransformer config
+        embeddings = OnnxInt8Embeddings(model_name, ONNX_INT8_DIR, batch_size=256, max_length=512)
+        print("E5 model initialized on CPU (ONNX Runtime, INT8).")
+        return with_cache(embeddings, EMBED_CACHE_DIR, f"{model_name}-onnx-int8")
+
+    print("Initializing E5 HuggingFace Embeddings model...")
+    model_kwargs = {"device": "cuda" if use_cuda else "cpu"}
+    if use_cuda:
+        # Half-precision weights on GPU: ~2x encoder throughput and half the VRAM; bf16 where supported
+        dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        model_kwargs["model_kwargs"] = {"torch_dtype": dtype}
+    # Tune batch size for your GPU/CPU (half precision leaves room for larger GPU batches)
+    encode_kwargs = {"batch_size": 512 if use_cuda else 256, "normalize_embeddings": True}
+    embeddings = HuggingFaceEmbeddings(model_name=model_name, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs)
+    print(f"E5 model initialized on {'CUDA' if use_cuda else 'CPU'}.")
+    if COMPILE_ENCODER and use_cuda:
+        print("Compiling encoder with torch.compile (first batch will be slow)...")
+        compile_encoder(embeddings)
+
+    # Optional: prefer TensorFloat32 on Ampere+ for speed
+    try:
+        torch.set_float32_matmul_precision("high")
+    except Exception:
+        pass
+    return with_cache(embeddings, EMBED_CACHE_DIR, f"{model_name}-{'cuda' if use_cuda else 'cpu'}")
 
 
 # --- 3. Helper to build FAISS in batches ---
-def build_faiss_batched_texts(texts, metas, save_path, batch_size=1000, checkpoint_every_batches=25):
-    assert len(texts) == len(metas)
-    if not texts:
+def judgments_index_spec(n_vectors):
+    """OPQ-rotated IVF-PQ for the large Judgments store (32 bytes per 768-d E5 vector instead of 3072);
+    None keeps LangChain's exact flat index for small stores."""
+    if n_vectors < 100_000:
         return None
+    nlist = min(4096, int(4 * math.sqrt(n_vectors)))
+    return f"OPQ32,IVF{nlist},PQ32"
+
+
+def train_index(index, sample):
+    """Trains a faiss index, on GPU 0 when available (k-means/PQ training is the expensive part),
+    then copies the trained index back to CPU so LangChain can save it."""
+    if faiss.get_num_gpus() > 0:
+        try:
+            res = faiss.StandardGpuResources()
+            gpu_index = faiss.index_cpu_to_gpu(res, 0, index)
+            gpu_index.train(sample)
+            return faiss.index_gpu_to_cpu(gpu_index)
+        except Exception as e:
+            print(f"GPU training unavailable for this index ({e}); training on CPU.")
+    index.train(sample)
+    return index
+
+
+def _batches(items, batch_size):
+    it = iter(items)
+    while batch := list(islice(it, batch_size)):
+        yield batch
+
+
+def _read_chunk_log(path):
+    """Reads back the (texts, metas) batches appended by embed_to_disk, dropping a torn trailing record."""
+    texts, metas = [], []
+    if not os.path.exists(path):
+        return texts, metas
+    good = 0
+    with open(path, "rb") as f:
+        while True:
+            try:
+                batch_texts, batch_metas = pickle.load(f)
+            except EOFError:
+                break
+            except Exception:
+                print(f"WARNING: truncated record in {path}; resuming from the last complete batch.")
+                break
+            texts.extend(batch_texts)
+            metas.extend(batch_metas)
+            good = f.tell()
+    if os.path.getsize(path) > good:
+        os.truncate(path, good)
+    return texts, metas
+
+
+def corpus_fingerprint(files):
+    """Identifies what embed_to_disk would produce for `files`: model, encoder backend, chunking and
+    extraction settings, and each file's path, size and mtime."""
+    backend = "onnx-int8" if EMBED_BACKEND == "onnx-int8" and not torch.cuda.is_available() else "torch"
+    h = hashlib.sha256(f"{E5_MODEL_NAME}|{backend}|{CHUNK_SIZE}|{CHUNK_OVERLAP}|{SPLITTER_VERSION}|{EXTRACT_VERSION}".encode("utf-8"))
+    for path in files:
+        st = os.stat(path)
+        h.update(f"\n{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def embed_to_disk(embeddings, items, prefix, batch_size=4096, fingerprint=None):
+    """Pass 1: streams (text, metadata) pairs through embed_documents, appending float16 vectors to
+    `{prefix}.f16` and the batch's texts/metadatas to `{prefix}.pkl`. The chunk count is not known
+    up front, so the vector file is appended to and memory-mapped afterwards rather than preallocated.
+    `{prefix}.json` records the vector width and the corpus `fingerprint` before the first batch (and
+    the count once done): an interrupted run resumes after the last complete batch and a finished one
+    is reused as is, but only while the fingerprint matches; otherwise embedding starts over."""
+    vec_path, log_path, info_path = f"{prefix}.f16", f"{prefix}.pkl", f"{prefix}.json"
+    info = None
+    if os.path.exists(info_path):
+        with open(info_path) as f:
+            info = json.load(f)
+        if info.get("fingerprint") != fingerprint:
+            print(f"Precomputed embeddings in '{vec_path}' are for a different corpus or model; re-embedding.")
+            for path in (vec_path, log_path, info_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            info = None
+    if info is not None and "n" in info:
+        print(f"Reusing {info['n']} precomputed embeddings from '{vec_path}'.")
+        return info["n"], info["dim"]
 
-    # Seed the index with a tiny subset for stability
-    seed_n = min(8, len(texts))
-    db = FAISS.from_texts(texts[:seed_n], embeddings, metadatas=metas[:seed_n])
-
-    pbar = tqdm(range(seed_n, len(texts), batch_size), desc="Embedding batches", unit="batch")
-    for step, i in enumerate(pbar, start=1):
-        j = i + batch_size
-        batch_texts = texts[i:j]
-        batch_metas = metas[i:j]
-        if batch_texts:
-            db.add_texts(batch_texts, metadatas=batch_metas)
-        if step % checkpoint_every_batches == 0:
-            db.save_local(save_path)
-            pbar.set_postfix_str(f"checkpoint@{step}")
+    if info is None:
+        # Width from the model itself, never inferred from file sizes
+        info = {"fingerprint": fingerprint, "dim": len(embeddings.embed_query("passage: dim probe"))}
+        for path in (vec_path, log_path):
+            if os.path.exists(path):
+                os.remove(path)
+        _write_json(info_path, info)
+    dim = info["dim"]
 
+    n = len(_read_chunk_log(log_path)[0])
+    if os.path.exists(vec_path):
+        if os.path.getsize(vec_path) < n * dim * 2:
+            raise RuntimeError(f"'{vec_path}' holds fewer vectors than '{log_path}' has chunks; "
+                               "delete both to rebuild.")
+        # Vectors are written before their batch record, so the vector file may run ahead; trim it to whole logged rows
+        os.truncate(vec_path, n * dim * 2)
+    if n:
+        print(f"Resuming after {n} already embedded chunks.")
+        items = islice(items, n, None)
+
+    pbar = tqdm(desc="Embedding chunks", unit="chunk", initial=n)
+    with open(vec_path, "ab") as vf, open(log_path, "ab") as lf:
+        for batch in _batches(items, batch_size):
+            batch_texts = [t for t, _ in batch]
+            batch_metas = [m for _, m in batch]
+            del batch
+            with torch.inference_mode():  # no autograd bookkeeping around the forward passes
+                vecs = np.asarray(embeddings.embed_documents(batch_texts), dtype=np.float16)
+            if vecs.shape[1] != dim:
+                raise RuntimeError(f"Encoder returned {vecs.shape[1]}-d vectors, expected {dim}.")
+            vf.write(vecs.tobytes())
+            vf.flush()
+            pickle.dump((batch_texts, batch_metas), lf, protocol=pickle.HIGHEST_PROTOCOL)
+            lf.flush()
+            n += len(vecs)
+            pbar.update(len(vecs))
+    pbar.close()
+
+    _write_json(info_path, {**info, "n": n})
+    return n, dim
+
+
+def build_faiss_batched_texts(embeddings, items, save_path, batch_size=4096, index_spec=None,
+                              train_size=40_000, nprobe=32, add_batch=65_536, fingerprint=None):
+    """Two-phase build. Pass 1 (embed_to_disk) embeds the stream into a float16 file next to
+    `save_path`; pass 2 memory-maps it and builds the faiss index in one go, adding `add_batch`
+    float32 rows at a time, then attaches the docstore. `index_spec` is a faiss factory string (inner
+    product), None for LangChain's exact flat index, or a callable mapping the vector count to either.
+    Trainable indexes are trained on `train_size` vectors sampled across the whole corpus."""
+    prefix = f"{save_path}_vecs"
+    n, dim = embed_to_disk(embeddings, items, prefix, batch_size=batch_size, fingerprint=fingerprint)
+    if n == 0:
+        return None
+
+    vecs = np.memmap(f"{prefix}.f16", dtype=np.float16, mode="r", shape=(n, dim))
+    spec = index_spec(n) if callable(index_spec) else index_spec
+    if spec is None:
+        index = faiss.IndexFlatL2(dim)  # what FAISS.from_embeddings builds by default
+        distance_strategy = DistanceStrategy.EUCLIDEAN_DISTANCE
+    else:
+        print(f"Training {spec} on {min(train_size, n)} sampled vectors...")
+        index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+        sample_ids = np.sort(np.random.default_rng(0).choice(n, size=min(train_size, n), replace=False))
+        index = train_index(index, np.asarray(vecs[sample_ids], dtype=np.float32))
+        faiss.extract_index_ivf(index).nprobe = nprobe  # persisted with the index
+        distance_strategy = DistanceStrategy.MAX_INNER_PRODUCT
+    for i in tqdm(range(0, n, add_batch), desc="Adding to index", unit="batch"):
+        index.add(np.asarray(vecs[i:i + add_batch], dtype=np.float32))
+    del vecs
+
+    texts, metas = _read_chunk_log(f"{prefix}.pkl")
+    ids = [str(uuid.uuid4()) for _ in range(n)]
+    docstore = InMemoryDocstore({
+        doc_id: Document(page_content=t, metadata=m) for doc_id, t, m in zip(ids, texts, metas)
+    })
+    del texts, metas
+    db = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(ids)),
+        distance_strategy=distance_strategy,
+    )
     db.save_local(save_path)
+    # The store is saved; drop the intermediate files so the next rebuild re-reads the corpus
+    for ext in (".f16", ".pkl", ".json"):
+        os.remove(f"{prefix}{ext}")
     return db
 
 
-# --- 4. Build Acts ---
-start_time = time.time()
-print(f"--- Building '{FAISS_ACTS_PATH}' (E5) ---")
-act_documents = process_documents_from_path(ACTS_CORPUS_PATH)
-if act_documents:
-    acts_e5_docs = _to_e5_passage_docs(act_documents)
-    print(f"Acts chunks: {len(acts_e5_docs)}. Creating FAISS store (E5)...")
-    db_acts = FAISS.from_documents(acts_e5_docs, embeddings)
-    db_acts.save_local(FAISS_ACTS_PATH)
-    print(f"SUCCESS: '{FAISS_ACTS_PATH}' saved.")
-else:
-    print(f"WARNING: No documents in {ACTS_CORPUS_PATH}. Skipping.")
-print(f"--- Acts finished in {time.time() - start_time:.2f}s ---")
-
-# --- 5. Build Judgments (large) ---
-start_time = time.time()
-print(f"\n--- Building '{FAISS_JUDGMENTS_PATH}' (E5) ---")
-judgment_documents = process_documents_from_path(JUDGMENTS_CORPUS_PATH)
-if judgment_documents:
-    jd_e5_docs = _to_e5_passage_docs(judgment_documents)
-    N = len(jd_e5_docs)
-    print(f"Judgment chunks to embed: {N}")
-    texts = [d.page_content for d in jd_e5_docs]
-    metas = [d.metadata for d in jd_e5_docs]
-
-    # Choose batch size for FAISS ingestion (independent of encoder batch)
-    faiss_batch = 1000  # adjust 500–3000 depending on RAM
-    print("Creating FAISS vector store for Judgments (E5) in batches... THIS WILL TAKE A LONG TIME.")
-    db_j = build_faiss_batched_texts(texts, metas, FAISS_JUDGMENTS_PATH, batch_size=faiss_batch, checkpoint_every_batches=20)
-    print(f"SUCCESS: '{FAISS_JUDGMENTS_PATH}' saved.")
-else:
-    print(f"WARNING: No documents in {JUDGMENTS_CORPUS_PATH}. Skipping.")
-print(f"--- Judgments finished in {time.time() - start_time:.2f}s ---")
-
-print("\n--- All E5 vector stores built! ---")
+def release_acts_memory():
+    """Drops what the Acts build left behind before the much larger Judgments build starts: Python-side
+    garbage (docstore, vectors) and the CUDA caching allocator's freed blocks, so Judgments batches get
+    unfragmented GPU memory."""
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def main():
+    embeddings = init_embeddings()
+
+    # --- 4. Build Acts ---
+    start_time = time.time()
+    print(f"--- Building '{FAISS_ACTS_PATH}' (E5) ---")
+    files = list_corpus_files(ACTS_CORPUS_PATH)
+    if files:
+        print(f"Acts files: {len(files)}. Streaming chunks into FAISS store (E5)...")
+        # E5 passage instruction prefix applied as chunks stream out of the workers
+        chunks = (("passage: " + t, m) for t, m in iter_chunks(files))
+        db_acts = build_faiss_batched_texts(embeddings, chunks, FAISS_ACTS_PATH, fingerprint=corpus_fingerprint(files))
+        if db_acts is not None:
+            print(f"SUCCESS: '{FAISS_ACTS_PATH}' saved ({db_acts.index.ntotal} chunks).")
+        else:
+            print(f"WARNING: No text extracted from {ACTS_CORPUS_PATH}. Skipping.")
+    else:
+        print(f"WARNING: No documents in {ACTS_CORPUS_PATH}. Skipping.")
+    db_acts = None
+    release_acts_memory()
+    print(f"--- Acts finished in {time.time() - start_time:.2f}s ---")
+
+    # --- 5. Build Judgments (large) ---
+    start_time = time.time()
+    print(f"\n--- Building '{FAISS_JUDGMENTS_PATH}' (E5) ---")
+    files = list_corpus_files(JUDGMENTS_CORPUS_PATH)
+    if files:
+        print(f"Judgment files to embed: {len(files)}")
+        chunks = (("passage: " + t, m) for t, m in iter_chunks(files))
+
+        # Texts per embed_documents call (independent of encoder batch)
+        faiss_batch = 4096  # adjust 1000–8192 depending on RAM
+        print("Embedding Judgments (E5) to disk in batches, then building the FAISS index... "
+              "THIS WILL TAKE A LONG TIME.")
+        db_j = build_faiss_batched_texts(embeddings, chunks, FAISS_JUDGMENTS_PATH, batch_size=faiss_batch,
+                                         index_spec=judgments_index_spec, fingerprint=corpus_fingerprint(files))
+        if db_j is not None:
+            print(f"SUCCESS: '{FAISS_JUDGMENTS_PATH}' saved ({db_j.index.ntotal} chunks).")
+        else:
+            print(f"WARNING: No text extracted from {JUDGMENTS_CORPUS_PATH}. Skipping.")
+    else:
+        print(f"WARNING: No documents in {JUDGMENTS_CORPUS_PATH}. Skipping.")
+    print(f"--- Judgments finished in {time.time() - start_time:.2f}s ---")
+
+    print("\n--- All E5 vector stores built! ---")
+
+
+# Guarded so process-pool workers (spawned on Windows/macOS) can import this module without rebuilding
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,23 @@
+import asyncio
 import os
 import subprocess
 import sys
 import json
+from collections import deque
 
 # --- Configuration ---
 API_KEY_FILE = "api_keys.json"
 OUTPUT_DIR = "CaseLawData"
 QUERY_FILE_MASTER = "queries.txt" # The file with ALL queries
+LOG_TAIL_LINES = 200 # ikapi.py output lines kept for the error report
 PAGES_PER_QUERY = 20  # Set this to your new, higher target (e.g., 20 or 30)
+# Opt-in (RUN_KEYS_CONCURRENTLY=1 or --concurrent): with several keys, first run them concurrently on
+# disjoint slices of the query list; any failure falls back to the serial key-by-key loop over the full list.
+# Off by default: every ikapi.py process writes into the same OUTPUT_DIR, so two partitions whose queries
+# return the same judgment race on its doc path (one can read a half-written file as "already downloaded"),
+# and nothing dedupes documents across partitions, so overlapping results are fetched and billed once per key.
+RUN_KEYS_CONCURRENTLY = os.environ.get("RUN_KEYS_CONCURRENTLY") == "1" or "--concurrent" in sys.argv[1:]
+QUERY_PART_TEMPLATE = "queries_part_{}.txt"
 
 # A comprehensive dictionary of all queries organized by category
 # This will be used to create 'queries.txt' if it doesn't exist
@@ -87,6 +97,10 @@ QUERIES_BY_CATEGORY = {
     }
 }
 
+# Flattened once at import; every run reads these instead of re-walking the nested dict
+ALL_QUERIES = tuple(q for subs in QUERIES_BY_CATEGORY.values() for qs in subs.values() for q in qs)
+ALL_QUERIES_SET = frozenset(ALL_QUERIES)
+
 def load_api_keys():
     """Loads a list of API keys from the JSON file."""
     try:
@@ -107,23 +121,91 @@ def load_api_keys():
 def write_master_query_file():
     """Creates queries.txt from the dictionary if it doesn't exist."""
     if os.path.exists(QUERY_FILE_MASTER):
+        with open(QUERY_FILE_MASTER, 'r', encoding='utf-8') as f:
+            missing = len(ALL_QUERIES_SET.difference(line.rstrip("\n") for line in f))
         print(f"'{QUERY_FILE_MASTER}' already exists. Using it.")
+        if missing:
+            print(f"Note: {missing} queries defined in this script are not in '{QUERY_FILE_MASTER}'.")
         return
 
     print(f"'{QUERY_FILE_MASTER}' not found. Generating from script...")
-    all_queries = []
-    for category, subcategories in QUERIES_BY_CATEGORY.items():
-        for subcategory, queries in subcategories.items():
-            all_queries.extend(queries)
-
     try:
-        with open(QUERY_FILE_MASTER, 'w', encoding='utf-8') as f:
-            for query in all_queries:
-                f.write(f"{query}\n")
-        print(f"Successfully created '{QUERY_FILE_MASTER}' with {len(all_queries)} queries.")
+        with open(QUERY_FILE_MASTER, 'w', encoding='utf-8', newline='\n') as f:
+            # One joined write instead of a format + write per query
+            f.write("\n".join(ALL_QUERIES))
+            f.write("\n")
+        print(f"Successfully created '{QUERY_FILE_MASTER}' with {len(ALL_QUERIES)} queries.")
     except IOError as e:
         print(f"Error: Could not write to file {QUERY_FILE_MASTER}. {e}")
 
+def run_ikapi(command):
+    """Runs ikapi.py, streaming its combined stdout/stderr to the console line by line.
+    Raises CalledProcessError carrying the output tail on a non-zero exit."""
+    tail = deque(maxlen=LOG_TAIL_LINES)
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1) as proc:
+        for line in proc.stdout:
+            print(line, end='')
+            tail.append(line)
+        returncode = proc.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command, output="".join(tail))
+
+def build_command(api_key, query_file):
+    return [
+        sys.executable,  # Use the current Python interpreter
+        "ikapi.py",
+        "-s", api_key,
+        "-D", OUTPUT_DIR,
+        "-Q", query_file,
+        "-p", str(PAGES_PER_QUERY),
+        "--pathbysrc"
+    ]
+
+def write_query_partitions(n):
+    """Splits the master query file round-robin into n part files and returns their paths."""
+    with open(QUERY_FILE_MASTER, 'r', encoding='utf-8') as f:
+        queries = [line.rstrip("\n") for line in f if line.strip()]
+    paths = []
+    for i in range(n):
+        part = queries[i::n]
+        if not part:
+            continue
+        path = QUERY_PART_TEMPLATE.format(i + 1)
+        with open(path, 'w', encoding='utf-8', newline='\n') as f:
+            f.write("\n".join(part))
+            f.write("\n")
+        paths.append(path)
+    return paths
+
+async def _run_ikapi_async(label, command):
+    """Async counterpart of run_ikapi: streams prefixed output and returns (returncode, output tail)."""
+    proc = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                stderr=asyncio.subprocess.STDOUT)
+    tail = deque(maxlen=LOG_TAIL_LINES)
+    async for raw in proc.stdout:
+        line = raw.decode('utf-8', errors='replace')
+        print(f"[{label}] {line}", end='')
+        tail.append(line)
+    return await proc.wait(), "".join(tail)
+
+async def _run_keys_concurrently(api_keys, query_files):
+    return await asyncio.gather(*(
+        _run_ikapi_async(f"key #{i + 1}", build_command(api_key, query_file))
+        for i, (api_key, query_file) in enumerate(zip(api_keys, query_files))
+    ))
+
+def run_collection_concurrent(api_keys):
+    """Runs one ikapi.py per key, each on its own slice of the queries. Returns True if all succeeded."""
+    query_files = write_query_partitions(len(api_keys))
+    print(f"\n--- Running {len(query_files)} API keys concurrently on disjoint query slices ---")
+    results = asyncio.run(_run_keys_concurrently(api_keys, query_files))
+    failed = [i for i, (returncode, _) in enumerate(results) if returncode != 0]
+    for i in failed:
+        print(f"--- API Key #{i + 1} Failed or Expired ---")
+        print(f"Last {LOG_TAIL_LINES} lines from ikapi.py:")
+        print(results[i][1])
+    return not failed
+
 def run_collection():
     """
     Loops through API keys and runs the collection script.
@@ -140,39 +222,38 @@ def run_collection():
     # 2. Make sure the master query file exists
     write_master_query_file()
 
+    if RUN_KEYS_CONCURRENTLY and len(api_keys) > 1:
+        ok = run_collection_concurrent(api_keys)
+        if ok:
+            print("\n--- Data Collection Process Completed Successfully ---")
+            return
+        # ikapi.py skips files already on disk, so the serial retry only spends credits on what is missing
+        print("Some keys failed; falling back to trying keys one at a time over all queries...")
+
     # 3. Loop through each API key
     for i, api_key in enumerate(api_keys):
         print(f"\n--- Attempting to run with API Key #{i + 1} ---")
 
-        # 4. Construct the command
-        command = [
-            sys.executable,  # Use the current Python interpreter
-            "ikapi.py",
-            "-s", api_key,
-            "-D", OUTPUT_DIR,
-            "-Q", QUERY_FILE_MASTER, # Always use the master list of all queries
-            "-p", str(PAGES_PER_QUERY),
-            "--pathbysrc"
-        ]
+        # 4. Construct the command (always the master list of all queries)
+        command = build_command(api_key, QUERY_FILE_MASTER)
 
         print(f"Executing command for {PAGES_PER_QUERY} pages per query...")
 
         # 5. Run the ikapi.py script
         try:
-            # We use subprocess.run, which waits for the command to complete
-            result = subprocess.run(command, check=True, capture_output=True, text=True)
+            # Output is forwarded live; only the last lines are kept for the failure report
+            run_ikapi(command)
 
             # If the script finishes without error, it means all queries
             # were completed to the target page count. We are done.
             print("\n--- Data Collection Process Completed Successfully ---")
-            print(result.stdout)
             break # Exit the loop
 
         except subprocess.CalledProcessError as e:
             # This block will catch the 403 error we raised in ikapi.py
             print(f"--- API Key #{i + 1} Failed or Expired ---")
-            print("Error log from ikapi.py:")
-            print(e.stderr)
+            print(f"Last {LOG_TAIL_LINES} lines from ikapi.py:")
+            print(e.output)
             print("Trying next key in the list...")
             continue # Move to the next key in the loop
 
@@ -1,87 +1,276 @@
+import os
+import gc
 import time
 import math
+import uuid
+import pickle
+import shutil
+
+# Let OpenMP/MKL use every core; must be set before torch is imported
+os.environ.setdefault("OMP_NUM_THREADS", str(os.cpu_count() or 1))
+
 from tqdm import tqdm
+import numpy as np
+import faiss
 import torch
+
+# Encoding is one large GEMM stream: give intra-op parallelism all cores, no inter-op fan-out
+torch.set_num_threads(os.cpu_count() or 1)
+torch.set_num_interop_threads(1)
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
 from langchain_huggingface import HuggingFaceEmbeddings
-from first_process_corpus import process_documents_from_path
+from first_process_corpus import (
+    process_documents_from_path, load_corpus_parquet,
+    ACTS_CORPUS_PATH, JUDGMENTS_CORPUS_PATH, ACTS_PARQUET_PATH, JUDGMENTS_PARQUET_PATH,
+)
+from onnx_embeddings import OnnxInt8Embeddings
+from embedding_cache import with_cache
 
 # --- 1. Paths ---
-ACTS_CORPUS_PATH = "data_corpus/Acts"
-JUDGMENTS_CORPUS_PATH = "data_corpus/Judgments"
+# Corpus and parquet paths come from first_process_corpus (resolved from its location, so the parquet it
+# writes is found here whatever the CWD); the parquet is reused instead of re-reading the raw corpus when present
 FAISS_ACTS_PATH = "faiss_acts"
 FAISS_JUDGMENTS_PATH = "faiss_judgments"
 
+# Set EMBED_BACKEND=onnx-int8 to encode on CPU with a dynamically quantized ONNX export of the model
+EMBED_BACKEND = os.environ.get("EMBED_BACKEND", "torch")
+ONNX_INT8_DIR = os.environ.get("ONNX_INT8_DIR", "onnx_minilm_int8")
+# Set EMBED_CACHE_DIR to keep document vectors on disk keyed by chunk hash; reruns only encode new chunks
+EMBED_CACHE_DIR = os.environ.get("EMBED_CACHE_DIR")
+# Set COMPILE_ENCODER=1 to torch.compile the encoder on GPU builds (compile cost amortises over the corpus)
+COMPILE_ENCODER = os.environ.get("COMPILE_ENCODER") == "1"
+
 # --- 2. Embeddings init (GPU-aware) ---
-print("Initializing local HuggingFace Embeddings model...")
-model_name = "sentence-transformers/all-MiniLM-L6-v2"
-use_cuda = torch.cuda.is_available()
-model_kwargs = {"device": "cuda" if use_cuda else "cpu"}
-# Tune batch size: 256–1024 for A-series/30xx/40xx cards, 64–128 on low VRAM
-encode_kwargs = {"batch_size": 512, "normalize_embeddings": True}
-embeddings = HuggingFaceEmbeddings(model_name=model_name, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs)
-print(f"Local model initialized on {'CUDA' if use_cuda else 'CPU'}.")
-
-# Optional: prefer TensorFloat32 on Ampere+ for speed
-try:
-    torch.set_float32_matmul_precision("high")
-except Exception:
-    pass
+def compile_encoder(embeddings):
+    """Wraps the transformer inside the SentenceTransformer with torch.compile and runs one warmup batch.
+    dynamic=True because batches are padded to their longest text, so sequence length varies."""
+    st_model = embeddings._client
+    st_model[0].auto_model = torch.compile(st_model[0].auto_model, dynamic=True)
+    embeddings.embed_documents(["warmup"] * 8)
+
+def init_embeddings():
+    model_name = "sentence-transformers/all-MiniLM-L6-v2"
+    use_cuda = torch.cuda.is_available()
+    if EMBED_BACKEND == "onnx-int8" and not use_cuda:
+        print(f"Initializing INT8 ONNX Runtime embeddings from '{ONNX_INT8_DIR}'...")
+        embeddings = OnnxInt8Embeddings(model_name, ONNX_INT8_DIR)
+        print("Local model initialized on CPU (ONNX Runtime, INT8).")
+    else:
+        print("Initializing local HuggingFace Embeddings model...")
+        model_kwargs = {"device": "cuda" if use_cuda else "cpu"}
+        if use_cuda:
+            # Half-precision weights on GPU: ~2x encoder throughput and half the VRAM; bf16 where supported
+            dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+            model_kwargs["model_kwargs"] = {"torch_dtype": dtype}
+        # Tune batch size: 256–1024 for A-series/30xx/40xx cards, 64–128 on low VRAM
+        encode_kwargs = {"batch_size": 512, "normalize_embeddings": True}
+        embeddings = HuggingFaceEmbeddings(model_name=model_name, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs)
+        print(f"Local model initialized on {'CUDA' if use_cuda else 'CPU'}.")
+        if COMPILE_ENCODER and use_cuda:
+            print("Compiling encoder with torch.compile (first batch will be slow)...")
+            compile_encoder(embeddings)
+
+    # Optional: prefer TensorFloat32 on Ampere+ for speed
+    try:
+        torch.set_float32_matmul_precision("high")
+    except Exception:
+        pass
+    backend = "onnx-int8" if isinstance(embeddings, OnnxInt8Embeddings) else ("cuda" if use_cuda else "cpu")
+    return with_cache(embeddings, EMBED_CACHE_DIR, f"{model_name}-{backend}")
+
+def load_corpus(corpus_path, parquet_path):
+    if os.path.exists(parquet_path):
+        print(f"Loading pre-processed chunks from '{parquet_path}'")
+        return load_corpus_parquet(parquet_path)
+    return process_documents_from_path(corpus_path)
 
 # --- 3. Helper to build FAISS in batches ---
-def build_faiss_batched(texts, metas, save_path, batch_size=1000, checkpoint_every_batches=25):
+def judgments_index_spec(n_vectors):
+    """IVF-PQ for large stores: 48 x 8-bit sub-quantizers store 384-d vectors in 48 bytes (vs 1536 flat)
+    and each query only scans nprobe inverted lists. Small stores stay exact."""
+    if n_vectors < 100_000:
+        return "Flat"
+    nlist = min(4096, int(4 * math.sqrt(n_vectors)))
+    return f"IVF{nlist},PQ48"
+
+def train_index(index, sample):
+    """Trains a faiss index, on GPU 0 when available (k-means/PQ training is the expensive part),
+    then copies the trained index back to CPU so LangChain can save it."""
+    if faiss.get_num_gpus() > 0:
+        try:
+            res = faiss.StandardGpuResources()
+            gpu_index = faiss.index_cpu_to_gpu(res, 0, index)
+            gpu_index.train(sample)
+            return faiss.index_gpu_to_cpu(gpu_index)
+        except Exception as e:
+            print(f"GPU training unavailable for this index ({e}); training on CPU.")
+    index.train(sample)
+    return index
+
+def _add_batch(db, vecs, texts, metas):
+    start = db.index.ntotal
+    db.index.add(vecs)
+    ids = [str(uuid.uuid4()) for _ in texts]
+    db.docstore.add({
+        doc_id: Document(page_content=text, metadata=meta)
+        for doc_id, text, meta in zip(ids, texts, metas)
+    })
+    db.index_to_docstore_id.update(enumerate(ids, start=start))
+
+def _write_checkpoint(ckpt_dir, offset, unsaved):
+    """Appends the batches embedded since the last checkpoint as one vectors .npy + metadatas .pkl pair.
+    The .npy is renamed into place last, so a pair only counts once both files are complete."""
+    os.makedirs(ckpt_dir, exist_ok=True)
+    base = os.path.join(ckpt_dir, f"ck{offset:012d}")  # first row it holds; names sort in corpus order
+    with open(f"{base}.metas.tmp", "wb") as f:
+        pickle.dump([m for p in unsaved for m in p[2]], f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{base}.metas.tmp", f"{base}.metas.pkl")
+    np.save(f"{base}.tmp.npy", np.concatenate([p[0] for p in unsaved]))
+    os.replace(f"{base}.tmp.npy", f"{base}.vecs.npy")
+
+def _load_checkpoints(ckpt_dir, metas):
+    """Vectors appended by an interrupted run, in order; discarded if they do not line up with `metas`."""
+    if not os.path.isdir(ckpt_dir):
+        return []
+    loaded, n = [], 0
+    for name in sorted(os.listdir(ckpt_dir)):
+        if not name.endswith(".vecs.npy"):
+            continue
+        base = os.path.join(ckpt_dir, name[:-len(".vecs.npy")])
+        vecs = np.load(f"{base}.vecs.npy")
+        with open(f"{base}.metas.pkl", "rb") as f:
+            ck_metas = pickle.load(f)
+        if len(vecs) != len(ck_metas) or ck_metas != metas[n:n + len(ck_metas)]:
+            print(f"WARNING: checkpoints in '{ckpt_dir}' do not match the corpus; embedding from scratch.")
+            shutil.rmtree(ckpt_dir)
+            return []
+        loaded.append(vecs)
+        n += len(vecs)
+    return loaded
+
+def build_faiss_batched(embeddings, texts, metas, save_path, batch_size=4096, checkpoint_every_batches=6,
+                        index_spec="Flat", train_size=50_000, nprobe=32):
+    """Embeds `batch_size` chunks at a time and appends them straight to the index, so only one
+    batch of vectors is in flight. Embeddings are L2-normalised, so inner product ranks like cosine.
+    Indexes that need training (IVF/PQ) buffer the first `train_size` vectors, train on them, then stream.
+    Checkpoints only append the vectors embedded since the previous one to `{save_path}_ckpt`; a rerun
+    after an interruption replays them instead of re-embedding, and the store is serialised once at the end."""
     assert len(texts) == len(metas)
     if not texts:
         return None
 
-    # Seed the index with a tiny subset
-    seed_n = min(8, len(texts))
-    db = FAISS.from_texts(texts[:seed_n], embeddings, metadatas=metas[:seed_n])
+    ckpt_dir = f"{save_path}_ckpt"
+    resumed = _load_checkpoints(ckpt_dir, metas)
+    n_done = sum(len(v) for v in resumed)
+    if n_done:
+        print(f"Resuming from {n_done} checkpointed vectors in '{ckpt_dir}'.")
+
+    def batches():
+        i = 0
+        for vecs in resumed:
+            yield vecs, texts[i:i + len(vecs)], metas[i:i + len(vecs)], False
+            i += len(vecs)
+        for i in range(n_done, len(texts), batch_size):
+            j = i + batch_size
+            with torch.inference_mode():  # no autograd bookkeeping around the forward passes
+                vecs = np.asarray(embeddings.embed_documents(texts[i:j]), dtype=np.float32)
+            yield vecs, texts[i:j], metas[i:j], True
+
+    db = None
+    pending = []  # batches held back until the index is trained
+    unsaved = []  # freshly embedded batches not yet checkpointed
+    consumed = 0
+    total = len(resumed) + math.ceil((len(texts) - n_done) / batch_size)
+    pbar = tqdm(batches(), total=total, desc="Embedding batches", unit="batch")
+    for step, (vecs, batch_texts, batch_metas, fresh) in enumerate(pbar, start=1):
+        consumed += len(vecs)
+        if fresh:
+            unsaved.append((vecs, batch_texts, batch_metas))
 
-    pbar = tqdm(range(seed_n, len(texts), batch_size), desc="Embedding batches", unit="batch")
-    for step, i in enumerate(pbar, start=1):
-        j = i + batch_size
-        batch_texts = texts[i:j]
-        batch_metas = metas[i:j]
-        db.add_texts(batch_texts, metadatas=batch_metas)
+        if db is None:
+            db = FAISS(
+                embedding_function=embeddings,
+                index=faiss.index_factory(vecs.shape[1], index_spec, faiss.METRIC_INNER_PRODUCT),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={},
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+            )
 
-        if step % checkpoint_every_batches == 0:
-            db.save_local(save_path)
+        if not db.index.is_trained:
+            pending.append((vecs, batch_texts, batch_metas))
+            if sum(len(p[0]) for p in pending) < train_size and consumed < len(texts):
+                continue
+            pbar.set_postfix_str(f"training {index_spec}")
+            db.index = train_index(db.index, np.concatenate([p[0] for p in pending])[:train_size])
+            if index_spec.startswith("IVF"):
+                faiss.extract_index_ivf(db.index).nprobe = nprobe  # persisted with the index
+            for p in pending:
+                _add_batch(db, *p)
+            pending = []
+        else:
+            _add_batch(db, vecs, batch_texts, batch_metas)
+
+        if step % checkpoint_every_batches == 0 and unsaved:
+            _write_checkpoint(ckpt_dir, consumed - sum(len(p[0]) for p in unsaved), unsaved)
+            unsaved = []
             pbar.set_postfix_str(f"checkpoint@{step}")
 
     db.save_local(save_path)
+    shutil.rmtree(ckpt_dir, ignore_errors=True)
     return db
 
-# --- 4. Build Acts (usually small) ---
-start_time = time.time()
-print(f"--- Building '{FAISS_ACTS_PATH}' ---")
-act_documents = process_documents_from_path(ACTS_CORPUS_PATH)
-if act_documents:
-    print(f"Acts chunks: {len(act_documents)}. Creating FAISS store...")
-    db_acts = FAISS.from_documents(act_documents, embeddings)
-    db_acts.save_local(FAISS_ACTS_PATH)
-    print(f"SUCCESS: '{FAISS_ACTS_PATH}' saved.")
-else:
-    print(f"WARNING: No documents in {ACTS_CORPUS_PATH}. Skipping.")
-print(f"--- Acts finished in {time.time() - start_time:.2f}s ---")
-
-# --- 5. Build Judgments (very large) ---
-start_time = time.time()
-print(f"\n--- Building '{FAISS_JUDGMENTS_PATH}' ---")
-judgment_documents = process_documents_from_path(JUDGMENTS_CORPUS_PATH)
-if judgment_documents:
-    N = len(judgment_documents)
-    print(f"Judgment chunks to embed: {N}")
-    texts = [d.page_content for d in judgment_documents]
-    metas = [d.metadata for d in judgment_documents]
-
-    # Choose batch size for FAISS ingestion (independent of encoder batch)
-    faiss_batch = 1000  # adjust 500–3000 depending on RAM
-    print("Creating FAISS vector store for Judgments in batches... THIS WILL TAKE A LONG TIME.")
-    db_j = build_faiss_batched(texts, metas, FAISS_JUDGMENTS_PATH, batch_size=faiss_batch, checkpoint_every_batches=20)
-    print(f"SUCCESS: '{FAISS_JUDGMENTS_PATH}' saved.")
-else:
-    print(f"WARNING: No documents in {JUDGMENTS_CORPUS_PATH}. Skipping.")
-print(f"--- Judgments finished in {time.time() - start_time:.2f}s ---")
-
-print("\n--- All vector stores built! ---")
\ No newline at end of file
+def release_acts_memory():
+    """Drops what the Acts build left behind before the much larger Judgments build starts: Python-side
+    garbage (docstore, vectors) and the CUDA caching allocator's freed blocks, so Judgments batches get
+    unfragmented GPU memory."""
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def main():
+    embeddings = init_embeddings()
+
+    # --- 4. Build Acts (usually small) ---
+    start_time = time.time()
+    print(f"--- Building '{FAISS_ACTS_PATH}' ---")
+    acts_corpus = load_corpus(ACTS_CORPUS_PATH, ACTS_PARQUET_PATH)
+    if acts_corpus:
+        print(f"Acts chunks: {len(acts_corpus)}. Creating FAISS store...")
+        db_acts = build_faiss_batched(embeddings, acts_corpus.texts, acts_corpus.metadatas(), FAISS_ACTS_PATH)
+        print(f"SUCCESS: '{FAISS_ACTS_PATH}' saved.")
+    else:
+        print(f"WARNING: No documents in {ACTS_CORPUS_PATH}. Skipping.")
+    db_acts = acts_corpus = None
+    release_acts_memory()
+    print(f"--- Acts finished in {time.time() - start_time:.2f}s ---")
+
+    # --- 5. Build Judgments (very large) ---
+    start_time = time.time()
+    print(f"\n--- Building '{FAISS_JUDGMENTS_PATH}' ---")
+    judgments_corpus = load_corpus(JUDGMENTS_CORPUS_PATH, JUDGMENTS_PARQUET_PATH)
+    if judgments_corpus:
+        N = len(judgments_corpus)
+        print(f"Judgment chunks to embed: {N}")
+        texts = judgments_corpus.texts
+        metas = judgments_corpus.metadatas()
+
+        # Chunks embedded and added per step (independent of encoder batch); bounds peak vector memory
+        faiss_batch = 4096  # adjust 1000–8192 depending on RAM
+        index_spec = judgments_index_spec(N)
+        print(f"Creating FAISS vector store ({index_spec}) for Judgments in batches... THIS WILL TAKE A LONG TIME.")
+        db_j = build_faiss_batched(embeddings, texts, metas, FAISS_JUDGMENTS_PATH, batch_size=faiss_batch,
+                                   checkpoint_every_batches=5, index_spec=index_spec)
+        print(f"SUCCESS: '{FAISS_JUDGMENTS_PATH}' saved.")
+    else:
+        print(f"WARNING: No documents in {JUDGMENTS_CORPUS_PATH}. Skipping.")
+    print(f"--- Judgments finished in {time.time() - start_time:.2f}s ---")
+
+    print("\n--- All vector stores built! ---")
+
+
+# Guarded so process-pool workers (spawned on Windows/macOS) can import this module without rebuilding
+if __name__ == "__main__":
+    main()
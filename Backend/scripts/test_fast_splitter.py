@@ -0,0 +1,91 @@
+import random
+import re
+from bisect import bisect_left, bisect_right
+
+import pytest
+
+from fast_splitter import split, split_text
+
+
+def _split_any_separator(text, size, overlap):
+    """split() before separator priority: ends each chunk at the last separator of any kind."""
+    n = len(text)
+    if n <= size:
+        chunk = text.strip()
+        if chunk:
+            yield chunk
+        return
+    bounds = [m.end() for m in re.finditer(r"\n\n|\n|\. |, | ", text)]
+    start = 0
+    while start < n:
+        limit = start + size
+        if limit >= n:
+            end = n
+        else:
+            i = bisect_right(bounds, limit) - 1
+            end = bounds[i] if i >= 0 and bounds[i] > start + overlap else limit
+        chunk = text[start:end].strip()
+        if chunk:
+            yield chunk
+        if end >= n:
+            break
+        next_start = end - overlap
+        j = bisect_left(bounds, next_start)
+        start = bounds[j] if j < len(bounds) and bounds[j] < end else next_start
+
+
+def _words(rng, n):
+    return " ".join("".join(rng.choices("abcdefghij", k=rng.randint(1, 12))) for _ in range(n))
+
+
+def _paragraphs(n):
+    # Every paragraph is 98 characters, i.e. 100 with its "\n\n"
+    return "\n\n".join((f"Paragraph {i:03d} says this. " + "lorem ipsum, dolor sit amet " * 4)[:97] + "."
+                       for i in range(n))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_previous_split_with_one_separator_kind(seed):
+    # With only spaces there is no priority to apply, so the output must not change
+    rng = random.Random(seed)
+    text = _words(rng, rng.randint(0, 2000))
+    size = rng.randint(50, 400)
+    overlap = rng.randint(13, size - 1)  # longer than any word, so a space always falls inside it
+    assert list(split(text, size, overlap)) == list(_split_any_separator(text, size, overlap))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_chunks_fit_and_cover_the_text(seed):
+    rng = random.Random(seed)
+    seps = ["\n\n", "\n", ". ", ", ", " "]
+    text = "".join(_words(rng, rng.randint(1, 15)) + rng.choice(seps) for _ in range(300))
+    size, overlap = 300, 60
+    chunks = split_text(text, size, overlap)
+    assert all(0 < len(c) <= size for c in chunks)
+    pos = 0
+    for c in chunks:
+        found = text.find(c, max(0, pos - size))
+        assert found >= 0
+        assert found <= pos or not text[pos:found].strip()
+        pos = found + len(c)
+    assert not text[pos:].strip()
+
+
+def test_prefers_paragraph_breaks():
+    text = _paragraphs(30)
+    for chunk in split_text(text, 350, 150):
+        assert chunk.startswith("Paragraph") and chunk.endswith(".")
+
+
+def test_overlap_must_be_smaller_than_size():
+    with pytest.raises(ValueError):
+        split_text("some text", 100, 100)
+    with pytest.raises(ValueError):
+        split_text("some text", 100, 150)
+
+
+def test_parity_with_recursive_character_text_splitter():
+    text_splitters = pytest.importorskip("langchain_text_splitters")
+    splitter = text_splitters.RecursiveCharacterTextSplitter(chunk_size=350, chunk_overlap=150)
+    text = _paragraphs(40)
+    assert split_text(text, 350, 150) == splitter.split_text(text)
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+pytest.importorskip("tqdm")
+pytest.importorskip("fitz")
+pytest.importorskip("docx")
+pytest.importorskip("pytesseract")
+pytest.importorskip("pyarrow")
+
+from first_process_corpus import OCR_MIN_DPI, _ocr_scale
+
+
+class _Page:
+    """Stands in for fitz.Page; _ocr_scale only reads get_image_info()."""
+
+    def __init__(self, images):
+        self._images = images
+
+    def get_image_info(self):
+        return self._images
+
+
+def _scan(width_px, bbox=(0, 0, 612, 792)):
+    return {"width": width_px, "bbox": bbox}
+
+
+def test_page_without_images_uses_max_scale():
+    assert _ocr_scale(_Page([]), 2.0) == 2.0
+
+
+def test_scale_follows_native_resolution_between_bounds():
+    # 120 DPI across a 612pt-wide page: 8.5in * 120
+    assert _ocr_scale(_Page([_scan(1020)]), 2.0) == pytest.approx(120 / 72)
+
+
+def test_scale_is_clamped():
+    assert _ocr_scale(_Page([_scan(2550)]), 2.0) == 2.0  # 300 DPI scan, capped at the old fixed zoom
+    assert _ocr_scale(_Page([_scan(340)]), 2.0) == pytest.approx(OCR_MIN_DPI / 72)  # 40 DPI scan
+
+
+def test_largest_image_decides():
+    thumbnail = _scan(2000, bbox=(0, 0, 100, 100))
+    page = _Page([thumbnail, _scan(1020)])
+    assert _ocr_scale(page, 2.0) == pytest.approx(120 / 72)
+
+
+def test_never_above_the_fixed_zoom():
+    # Before native resolution was used every page rendered at dpi_scale; no page may cost more now
+    rng = random.Random(0)
+    for _ in range(1000):
+        x0, y0 = rng.uniform(0, 300), rng.uniform(0, 300)
+        images = [_scan(rng.randint(1, 5000), bbox=(x0, y0, x0 + rng.uniform(0, 600), y0 + rng.uniform(1, 800)))
+                  for _ in range(rng.randint(0, 3))]
+        max_scale = rng.choice([1.0, 2.0, 3.0])
+        assert _ocr_scale(_Page(images), max_scale) <= max_scale
@@ -0,0 +1,28 @@
+import random
+import re
+
+import pytest
+
+pytest.importorskip("fitz")
+pytest.importorskip("pyarrow")
+pytest.importorskip("langchain")
+
+from process_corpus import clean_text
+
+_RE_BLANKLINE = re.compile(r'\n\s*\n')
+_RE_WSP = re.compile(r'[ \t]+')
+
+
+def _clean_text_two_pass(text):
+    """clean_text before the two substitutions were merged into one pass."""
+    text = _RE_BLANKLINE.sub('\n\n', text)
+    text = _RE_WSP.sub(' ', text)
+    return text.strip()
+
+
+def test_clean_text_matches_two_pass_version():
+    rng = random.Random(0)
+    alphabet = ["a", "b", " ", "\t", "\n", "\r", "\x0b", "\x0c", " ", " "]
+    for _ in range(20000):
+        text = "".join(rng.choices(alphabet, k=rng.randint(0, 40)))
+        assert clean_text(text) == _clean_text_two_pass(text)
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+pytest.importorskip("torch")
+pytest.importorskip("langchain_community")
+pytest.importorskip("langchain_huggingface")
+pytest.importorskip("fitz")
+pytest.importorskip("docx")
+pytest.importorskip("pyarrow")
+
+import rebuild_vector_stores_e5 as e5
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for name in ("a.pdf", "b.docx"):
+        path = tmp_path / name
+        path.write_bytes(b"x" * 10)
+        paths.append(str(path))
+    return paths
+
+
+def test_fingerprint_is_stable(files):
+    assert e5.corpus_fingerprint(files) == e5.corpus_fingerprint(list(files))
+
+
+def test_fingerprint_tracks_file_changes(files):
+    before = e5.corpus_fingerprint(files)
+    st = os.stat(files[0])
+    os.utime(files[0], ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    touched = e5.corpus_fingerprint(files)
+    assert touched != before
+    with open(files[1], "ab") as f:
+        f.write(b"y")
+    assert e5.corpus_fingerprint(files) != touched
+
+
+def test_fingerprint_tracks_order_and_membership(files):
+    # Resume offsets index into the chunk stream, so a reordered or shorter file list must not match
+    fp = e5.corpus_fingerprint(files)
+    assert e5.corpus_fingerprint(files[::-1]) != fp
+    assert e5.corpus_fingerprint(files[:1]) != fp
+
+
+@pytest.mark.parametrize("name, value", [
+    ("CHUNK_SIZE", 999), ("CHUNK_OVERLAP", 199), ("EXTRACT_VERSION", -1),
+    ("SPLITTER_VERSION", -1), ("E5_MODEL_NAME", "intfloat/multilingual-e5-small"),
+])
+def test_fingerprint_tracks_settings(files, monkeypatch, name, value):
+    fp = e5.corpus_fingerprint(files)
+    monkeypatch.setattr(e5, name, value)
+    assert e5.corpus_fingerprint(files) != fp